@@ -1,4 +1,4 @@
-from .base import ConfigSnapshot, ConfigStage, Blob, ConfigRepo
+from .base import ConfigSnapshot, ConfigStage, Blob, ConfigRepo, SnapshotDiff
 from .impl.memory import create_memory_config_repo
 from .impl.git import create_git_config_repo
 
@@ -7,6 +7,7 @@ __all__ = [
     "ConfigStage",
     "Blob",
     "ConfigRepo",
+    "SnapshotDiff",
     "create_memory_config_repo",
     "create_git_config_repo",
 ]
@@ -1,4 +1,34 @@
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass, field
+
 Blob = bytes
+# Caller-owned buffer that `get_into` copies a blob into
+BlobBuffer = bytearray | memoryview
+
+
+def copy_blob_into(value: Blob | None, out: BlobBuffer) -> int | None:
+    """Copy `value` to the start of `out` and return its length, None for None."""
+    if value is None:
+        return None
+    size = len(value)
+    if size > len(out):
+        raise ValueError(f"Buffer of {len(out)} bytes is too small for {size} bytes")
+    out[:size] = value
+    return size
+
+
+@dataclass
+class SnapshotDiff:
+    """
+    Keys that differ between two snapshots, as seen from the older one.
+    """
+
+    added: set[str] = field(default_factory=set)
+    removed: set[str] = field(default_factory=set)
+    changed: set[str] = field(default_factory=set)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
 
 
 class ConfigSnapshot:
@@ -6,10 +36,29 @@ class ConfigSnapshot:
     Immutable snapshot of configuration data at a specific point in time.
     """
 
+    __slots__ = ()
+
     def get(self, key: str) -> Blob | None:
         """Retrieve the content of a blob by its key."""
         raise NotImplementedError()
 
+    def get_many(self, keys: Iterable[str]) -> dict[str, Blob | None]:
+        """Retrieve the contents of several blobs by their keys."""
+        return {key: self.get(key) for key in keys}
+
+    def get_into(self, key: str, out: BlobBuffer) -> int | None:
+        """
+        Copy the content of a blob into the start of `out`.
+
+        Returns the number of bytes written, or None if there is no such blob.
+        Raises ValueError if `out` is too small.
+        """
+        return copy_blob_into(self.get(key), out)
+
+    def diff(self, other: "ConfigSnapshot") -> SnapshotDiff:
+        """List the keys that changed going from `other` to this snapshot."""
+        raise NotImplementedError()
+
 
 class ConfigStage:
     """
@@ -20,14 +69,29 @@ class ConfigStage:
     These blobs can be modified in place when changed.
     """
 
+    __slots__ = ()
+
     def get(self, key: str) -> Blob | None:
         """Retrieve the content of a blob by its key, checking staged changes first."""
         raise NotImplementedError()
 
+    def get_many(self, keys: Iterable[str]) -> dict[str, Blob | None]:
+        """Retrieve the contents of several blobs by their keys, see `get`."""
+        return {key: self.get(key) for key in keys}
+
+    def get_into(self, key: str, out: BlobBuffer) -> int | None:
+        """Copy the content of a blob into `out`, see `ConfigSnapshot.get_into`."""
+        return copy_blob_into(self.get(key), out)
+
     def set(self, key: str, value: Blob | None) -> None:
         """Update or create a blob in the stage. Pass None to mark as deleted."""
         raise NotImplementedError()
 
+    def set_many(self, items: Mapping[str, Blob | None]) -> None:
+        """Update several blobs at once, see `set`."""
+        for key, value in items.items():
+            self.set(key, value)
+
     def is_dirty(self) -> bool:
         """Check if there are any staged changes."""
         raise NotImplementedError()
@@ -45,14 +109,29 @@ class ConfigRepo:
     state of staged changes
     """
 
+    __slots__ = ()
+
     def get(self, key: str) -> Blob | None:
         """Retrieve the content of a blob from the current stage."""
         raise NotImplementedError()
 
+    def get_many(self, keys: Iterable[str]) -> dict[str, Blob | None]:
+        """Retrieve the contents of several blobs from the current stage."""
+        return {key: self.get(key) for key in keys}
+
+    def get_into(self, key: str, out: BlobBuffer) -> int | None:
+        """Copy the content of a blob from the current stage into `out`."""
+        return copy_blob_into(self.get(key), out)
+
     def set(self, key: str, value: Blob | None) -> None:
         """Update or create a blob in the current stage."""
         raise NotImplementedError()
 
+    def set_many(self, items: Mapping[str, Blob | None]) -> None:
+        """Update or create several blobs in the current stage."""
+        for key, value in items.items():
+            self.set(key, value)
+
     def commit(self) -> None:
         """Commit the current stage to the repository history."""
         raise NotImplementedError()
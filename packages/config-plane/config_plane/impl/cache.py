@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+from collections.abc import Hashable, Iterable, Iterator
+from typing import Any
+
+from config_plane.base import Blob
+
+# Rough per-entry cost of the key and the dict slot, so cached misses (None)
+# are not free
+_ENTRY_OVERHEAD = 64
+
+
+def _entry_size(value: Blob | None) -> int:
+    return _ENTRY_OVERHEAD + (len(value) if value is not None else 0)
+
+
+class BlobCache:
+    """
+    LRU cache of blobs, bounded by their total size rather than their count.
+
+    None is a valid value, used to remember misses. Values larger than the
+    whole cache are not kept at all. Safe to share between threads.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data: OrderedDict[Hashable, Blob | None] = OrderedDict()
+        # Even a get reorders the entries
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def items(self) -> Iterator[tuple[Hashable, Blob | None]]:
+        with self._lock:
+            return iter(list(self._data.items()))
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Blob | None) -> None:
+        with self._lock:
+            self._put(key, value)
+
+    def update(self, items: Iterable[tuple[Hashable, Blob | None]]) -> None:
+        with self._lock:
+            for key, value in items:
+                self._put(key, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def _put(self, key: Hashable, value: Blob | None) -> None:
+        if key in self._data:
+            self.size -= _entry_size(self._data.pop(key))
+        size = _entry_size(value)
+        if size > self.max_bytes:
+            return
+        self._data[key] = value
+        self.size += size
+        while self.size > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.size -= _entry_size(evicted)
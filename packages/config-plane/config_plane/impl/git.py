@@ -1,46 +1,342 @@
+import logging
+import os
+import shutil
 import subprocess
+import threading
+import time
+import weakref
+from collections.abc import Iterable, Mapping, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import cached_property
 from pathlib import Path
 from typing import Any
 
-from config_plane.base import ConfigRepo, ConfigSnapshot, ConfigStage, Blob
+from config_plane.base import (
+    ConfigRepo,
+    ConfigSnapshot,
+    ConfigStage,
+    Blob,
+    BlobBuffer,
+    SnapshotDiff,
+    copy_blob_into,
+)
+from config_plane.impl.cache import BlobCache
 from config_plane.impl.memory import MemoryConfigSnapshot
 
+logger = logging.getLogger(__name__)
+
+
+# Default for single-lookup dict.get() calls, where None is a valid value
+_MISS: Any = object()
+
+
+# Resolved once, instead of searching PATH on every spawn
+_GIT = shutil.which("git") or "git"
+
+# Set on top of the environment of every git process. Output is parsed, so
+# it must not be localized; read-only commands must not take optional locks
+# (like refreshing the index); and a missing credential must fail instead of
+# waiting for a prompt nobody will answer.
+_GIT_ENV_OVERRIDES = {
+    "LC_ALL": "C",
+    "GIT_OPTIONAL_LOCKS": "0",
+    "GIT_TERMINAL_PROMPT": "0",
+}
+
+
+def _git_env() -> dict[str, str]:
+    # Merged per call, later changes to os.environ (HOME, GIT_*) still apply
+    return {**os.environ, **_GIT_ENV_OVERRIDES}
+
 
 def _run_git(cwd: Path, args: list[str]) -> str:
-    result = subprocess.run(
-        ["git", *args],
-        cwd=cwd,
-        capture_output=True,
-        text=True,
-        check=True,
-    )
-    return result.stdout.strip()
+    # Decoded here rather than with text=True, which goes through the locale
+    return _run_git_bytes(cwd, args).decode("utf-8", "surrogateescape").strip()
 
 
-def _run_git_bytes(cwd: Path, args: list[str]) -> bytes:
+def _run_git_bytes(cwd: Path, args: list[str], input: bytes | None = None) -> bytes:
     result = subprocess.run(
-        ["git", *args],
+        [_GIT, *args],
         cwd=cwd,
+        env=_git_env(),
+        input=input,
         capture_output=True,
         check=True,
     )
     return result.stdout
 
 
+def _close_process(process: subprocess.Popen) -> None:
+    if process.stdin:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            # Unflushed requests to a process that already exited
+            pass
+    process.wait()
+    if process.stdout:
+        process.stdout.close()
+
+
+# Default bound on the values a snapshot keeps in memory
+_SNAPSHOT_CACHE_BYTES = 64 * 1024 * 1024
+
+# Pipelined requests are written in chunks that fit into the pipe buffer, so
+# git never blocks writing responses while we are still writing requests
+_MAX_PIPELINED_BYTES = 32 * 1024
+
+
+class _CatFileBatch:
+    """
+    Long-lived `git cat-file --batch` process.
+
+    Objects are requested over its stdin one per line, so reading many blobs
+    costs a single process spawn instead of one per read.
+    """
+
+    def __init__(self, repo_path: Path) -> None:
+        self.process = subprocess.Popen(
+            [_GIT, "cat-file", "--batch"],
+            cwd=repo_path,
+            env=_git_env(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        self._finalizer = weakref.finalize(self, _close_process, self.process)
+        # Requests and responses must not interleave between threads
+        self._lock = threading.Lock()
+
+    def read(self, rev: str) -> Blob | None:
+        """Return the content of the blob named by `rev`, None if there is none."""
+        return self.read_many([rev])[0]
+
+    def read_many(self, revs: Sequence[str]) -> list[Blob | None]:
+        """Like `read`, but pipelines the requests instead of waiting for each."""
+        assert self.process.stdin and self.process.stdout
+        requests = [rev.encode() + b"\n" for rev in revs]
+        results: list[Blob | None] = []
+        with self._lock:
+            start = 0
+            while start < len(requests):
+                end, size = start + 1, len(requests[start])
+                while (
+                    end < len(requests)
+                    and size + len(requests[end]) <= _MAX_PIPELINED_BYTES
+                ):
+                    size += len(requests[end])
+                    end += 1
+                self.process.stdin.write(b"".join(requests[start:end]))
+                self.process.stdin.flush()
+                results.extend(self._read_object() for _ in range(start, end))
+                start = end
+        return results
+
+    def read_into(self, rev: str, out: BlobBuffer) -> int | None:
+        """
+        Like `read`, but reads the content straight from the pipe into `out`.
+
+        Returns the size of the blob, raises ValueError if `out` is too small.
+        """
+        assert self.process.stdin and self.process.stdout
+        with self._lock:
+            self.process.stdin.write(rev.encode() + b"\n")
+            self.process.stdin.flush()
+            header = self._read_header()
+            if header is None:
+                return None
+            kind, size = header
+            if kind != b"blob" or size > len(out):
+                # Drain the object so the next response starts where expected
+                self.process.stdout.read(size + 1)
+                if kind != b"blob":
+                    return None
+                raise ValueError(
+                    f"Buffer of {len(out)} bytes is too small for {size} bytes"
+                )
+
+            view = memoryview(out)[:size]
+            done = 0
+            while done < size:
+                n = self.process.stdout.readinto(view[done:])
+                if not n:
+                    raise RuntimeError("git cat-file exited unexpectedly")
+                done += n
+            self.process.stdout.read(1)  # trailing newline
+            return size
+
+    def _read_header(self) -> tuple[bytes, int] | None:
+        assert self.process.stdout
+        # "<oid> <type> <size>" or "<rev> missing"
+        header = self.process.stdout.readline()
+        if not header:
+            raise RuntimeError("git cat-file exited unexpectedly")
+        parts = header.split()
+        # Keys may contain spaces, so only a numeric size marks a found object
+        if len(parts) != 3 or not parts[2].isdigit():
+            return None
+        return parts[1], int(parts[2])
+
+    def _read_object(self) -> Blob | None:
+        assert self.process.stdout
+        header = self._read_header()
+        if header is None:
+            return None
+
+        kind, size = header
+        content = self.process.stdout.read(size)
+        self.process.stdout.read(1)  # trailing newline
+        if kind != b"blob":
+            return None
+        return content
+
+    def close(self) -> None:
+        self._finalizer()
+
+
+class _GitSession:
+    """
+    Git processes shared by everything that reads from one repository.
+
+    Snapshots come and go with every commit and reload, the session lets
+    them reuse a single `cat-file --batch` process instead of each starting
+    its own.
+    """
+
+    def __init__(self, repo_path: Path) -> None:
+        self.repo_path = repo_path
+        # Started on first read, sessions that are never read cost nothing
+        self._batch: _CatFileBatch | None = None
+
+    def read(self, rev: str) -> Blob | None:
+        return self.read_many([rev])[0]
+
+    def read_many(self, revs: Sequence[str]) -> list[Blob | None]:
+        # The batch protocol takes one rev per line, a key holding a newline
+        # would split its request in two. Such revs get a process of their own.
+        if any("\n" in rev for rev in revs):
+            batched = iter(self.read_many([rev for rev in revs if "\n" not in rev]))
+            return [
+                self._read_once(rev) if "\n" in rev else next(batched)
+                for rev in revs
+            ]
+        if self._batch is None:
+            self._batch = _CatFileBatch(self.repo_path)
+        try:
+            return self._batch.read_many(revs)
+        except (BrokenPipeError, RuntimeError):
+            # The process died, its output can't be trusted anymore. Serve
+            # this call with one-off processes, the next one starts afresh.
+            self.close()
+            return [self._read_once(rev) for rev in revs]
+
+    def read_into(self, rev: str, out: BlobBuffer) -> int | None:
+        if "\n" in rev:
+            # See `read_many`
+            return copy_blob_into(self._read_once(rev), out)
+        if self._batch is None:
+            self._batch = _CatFileBatch(self.repo_path)
+        try:
+            return self._batch.read_into(rev, out)
+        except (BrokenPipeError, RuntimeError):
+            # See `read_many`
+            self.close()
+            return copy_blob_into(self._read_once(rev), out)
+
+    def _read_once(self, rev: str) -> Blob | None:
+        try:
+            return _run_git_bytes(self.repo_path, ["cat-file", "blob", rev])
+        except subprocess.CalledProcessError:
+            return None
+
+    def close(self) -> None:
+        if self._batch is not None:
+            self._batch.close()
+            self._batch = None
+
+
+def _diff_tree(repo_path: Path, old: str, new: str) -> list[tuple[bytes, str]]:
+    """The (status, key) of every key that differs between two commits."""
+    output = _run_git_bytes(
+        repo_path, ["diff-tree", "-r", "-z", "--no-renames", old, new]
+    )
+    # ":<modes> <oids> <status>\0<path>\0" per changed key
+    fields = output.split(b"\0")
+    statuses = [f.split()[-1] for f in fields[0:-1:2]]
+    return list(zip(statuses, (f.decode() for f in fields[1::2])))
+
+
 class GitConfigSnapshot(ConfigSnapshot):
-    def __init__(self, repo_path: Path, commit_hash: str):
+    def __init__(
+        self,
+        repo_path: Path,
+        commit_hash: str,
+        session: _GitSession | None = None,
+        cache_bytes: int = _SNAPSHOT_CACHE_BYTES,
+    ):
         self.repo_path = repo_path
         self.commit_hash = commit_hash
+        # Standalone snapshots get a session of their own
+        self._owns_session = session is None
+        self._session = session or _GitSession(repo_path)
+        # A commit never changes, so values read from it can be kept for the
+        # lifetime of the snapshot (misses are cached as None). Least
+        # recently used values are dropped past `cache_bytes`.
+        self._cache = BlobCache(cache_bytes)
 
     def get(self, key: str) -> Blob | None:
-        try:
-            # git show <commit>:<key>
-            content = _run_git_bytes(
-                self.repo_path, ["show", f"{self.commit_hash}:{key}"]
+        value = self._cache.get(key, _MISS)
+        if value is not _MISS:
+            return value
+        value = self._session.read(f"{self.commit_hash}:{key}")
+        self._cache.put(key, value)
+        return value
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, Blob | None]:
+        keys = list(keys)
+        values = {}
+        missing = []
+        for key in keys:
+            value = self._cache.get(key, _MISS)
+            if value is _MISS:
+                missing.append(key)
+            else:
+                values[key] = value
+        if missing:
+            read = self._session.read_many(
+                [f"{self.commit_hash}:{key}" for key in missing]
             )
-            return content
-        except subprocess.CalledProcessError:
-            return None
+            # Served from what was read, the cache may not hold all of it
+            values.update(zip(missing, read))
+            self._cache.update(zip(missing, read))
+        return {key: values[key] for key in keys}
+
+    def get_into(self, key: str, out: BlobBuffer) -> int | None:
+        value = self._cache.get(key, _MISS)
+        if value is not _MISS:
+            return copy_blob_into(value, out)
+        # Read past the cache, holding on to the value would defeat the point
+        size = self._session.read_into(f"{self.commit_hash}:{key}", out)
+        if size is None:
+            self._cache.put(key, None)
+        return size
+
+    def diff(self, other: ConfigSnapshot) -> SnapshotDiff:
+        if not isinstance(other, GitConfigSnapshot):
+            raise TypeError("Can only diff against another GitConfigSnapshot")
+        diff = SnapshotDiff()
+        if other.commit_hash == self.commit_hash:
+            return diff
+        changes = _diff_tree(self.repo_path, other.commit_hash, self.commit_hash)
+        # Anything but an addition or a deletion changed the value
+        by_status = {b"A": diff.added, b"D": diff.removed}
+        for status, key in changes:
+            by_status.get(status, diff.changed).add(key)
+        return diff
+
+    def close(self) -> None:
+        """Stop the background git process used for reads, unless it is shared."""
+        if self._owns_session:
+            self._session.close()
 
     def _repr_pretty_(self, p: Any, cycle: bool) -> None:
         if cycle:
@@ -49,60 +345,121 @@ class GitConfigSnapshot(ConfigSnapshot):
             p.text(f"GitConfigSnapshot(commit={self.commit_hash[:7]})")
 
 
+def _fast_import_path(key: str) -> str:
+    # Paths run to the end of the line, only a leading quote or a newline
+    # needs the C-style quoting
+    if key.startswith('"') or "\n" in key:
+        escaped = key.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return f'"{escaped}"'
+    return key
+
+
+def _write_commit(
+    repo_path: Path,
+    branch: str,
+    parents: Sequence[str],
+    changes: Mapping[str, Blob | None],
+    message: str,
+) -> str:
+    """
+    Commit `changes` on top of the first of `parents` and move `branch` to it.
+
+    Blobs, trees and the commit are all written by a single `git fast-import`
+    run, without a working tree or an index. The branch is only moved if it
+    still points at the first parent (or has no commit yet), the new commit
+    hash is returned.
+    """
+    ident = _run_git(repo_path, ["var", "GIT_COMMITTER_IDENT"]).encode()
+    encoded_message = message.encode()
+    stream = [
+        b"commit refs/heads/%s\n" % branch.encode(),
+        b"mark :1\n",
+        b"committer %s\n" % ident,
+        b"data %d\n%s\n" % (len(encoded_message), encoded_message),
+    ]
+    if parents:
+        stream.append(b"from %s\n" % parents[0].encode())
+    stream.extend(b"merge %s\n" % parent.encode() for parent in parents[1:])
+    for key, value in changes.items():
+        path = _fast_import_path(key).encode()
+        if value is None:
+            stream.append(b"D %s\n" % path)
+        else:
+            stream.append(b"M 100644 inline %s\n" % path)
+            stream.append(b"data %d\n%s\n" % (len(value), value))
+    stream.append(b"get-mark :1\n")
+
+    output = _run_git_bytes(
+        repo_path,
+        ["fast-import", "--quiet", "--cat-blob-fd=1"],
+        input=b"".join(stream),
+    )
+    return output.decode().strip()
+
+
 class GitConfigStage(ConfigStage):
-    def __init__(self, work_path: Path, snapshot: ConfigSnapshot):
-        self.work_path = work_path
+    def __init__(
+        self,
+        repo_path: Path,
+        branch: str,
+        snapshot: ConfigSnapshot,
+        session: _GitSession | None = None,
+    ):
+        self.repo_path = repo_path
+        self.branch = branch
         self.snapshot = snapshot
+        self.session = session
+        # Pending changes, None marks a deletion. They never touch the
+        # filesystem, freeze() writes them straight into the object store.
+        self.data: dict[str, Blob | None] = {}
 
     def get(self, key: str) -> Blob | None:
-        file_path = self.work_path / f"{key}"
-        if file_path.exists():
-            try:
-                return file_path.read_bytes()
-            except OSError:
-                return None
-
-        # Fallback to snapshot if not on disk (meaning not modified/new, or deleted)
-        # Wait, if it's deleted in stage, it won't exist on disk.
-        # But if it exists in snapshot, we should return what?
-        # If I delete a file in git, it's gone.
-        # So "not existing on disk" could mean "deleted" OR "never checked out" (but this is a repo, files should be there)
-        # OR "unchanged from snapshot" (files should be there).
-
-        # Actually, in a standard git repo, the working directory CONTAINS the current stage.
-        # If the file isn't there, it's not there.
-        # However, `snapshot` might be pointing to a previous commit.
-        # If I am in a "dirty" state, the file on disk IS the value.
-        # If the file is missing on disk, it returns None.
-        return None
+        value = self.data.get(key, _MISS)
+        if value is not _MISS:
+            return value
+        # Unstaged keys come from the committed snapshot, which is read from
+        # the object store once and cached
+        return self.snapshot.get(key)
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, Blob | None]:
+        keys = list(keys)
+        # One pipelined read for everything that is not staged
+        values = self.snapshot.get_many(key for key in keys if key not in self.data)
+        values.update((key, self.data[key]) for key in keys if key in self.data)
+        return {key: values[key] for key in keys}
+
+    def get_into(self, key: str, out: BlobBuffer) -> int | None:
+        value = self.data.get(key, _MISS)
+        if value is not _MISS:
+            return copy_blob_into(value, out)
+        return self.snapshot.get_into(key, out)
 
     def set(self, key: str, value: Blob | None) -> None:
-        file_path = self.work_path / f"{key}"
-
-        if value is None:
-            if file_path.exists():
-                file_path.unlink()
-                # We also need to tell git about the deletion if we want to be thorough,
-                # but `git add .` in freeze will catch it.
-        else:
-            file_path.write_bytes(value)
+        self.data[key] = None if value is None else bytes(value)
 
     def is_dirty(self) -> bool:
-        # Check if there are changes
-        status = _run_git(self.work_path, ["status", "--porcelain"])
-        return len(status) > 0
+        return len(self.data) > 0
 
     def freeze(self) -> ConfigSnapshot:
-        if not self.is_dirty():
+        # Pending changes may turn out to match what is already committed
+        committed = self.snapshot.get_many(self.data)
+        changes = {
+            key: value
+            for key, value in self.data.items()
+            if value != committed[key]
+        }
+        if not changes:
             # If not dirty, return current snapshot (or HEAD)
             # We assume self.snapshot is HEAD
             return self.snapshot
 
-        _run_git(self.work_path, ["add", "."])
-        _run_git(self.work_path, ["commit", "-m", "Update config"])
-
-        new_hash = _run_git(self.work_path, ["rev-parse", "HEAD"])
-        return GitConfigSnapshot(self.work_path, new_hash)
+        parents = []
+        if isinstance(self.snapshot, GitConfigSnapshot):
+            parents.append(self.snapshot.commit_hash)
+        new_hash = _write_commit(
+            self.repo_path, self.branch, parents, changes, "Update config"
+        )
+        return GitConfigSnapshot(self.repo_path, new_hash, self.session)
 
     def _repr_pretty_(self, p: Any, cycle: bool) -> None:
         if cycle:
@@ -111,66 +468,383 @@ class GitConfigStage(ConfigStage):
             p.text(f"GitConfigStage(dirty={self.is_dirty()})")
 
 
+def _convert_to_bare(work_path: Path) -> None:
+    """
+    Turn a clone with a working tree, as kept by earlier versions, into a
+    bare clone in place.
+
+    Every committed value is in the object store, only the checked out files
+    are dropped. Raises RuntimeError instead if the working tree holds any
+    file that is not committed, ignored ones included, or if another process
+    is converting it at the same time.
+    """
+    lock = work_path.with_name(f".{work_path.name}.lock")
+    try:
+        lock.touch(exist_ok=False)
+    except FileExistsError:
+        raise RuntimeError(
+            f"{work_path} is being converted to a bare clone by another "
+            f"process, retry once {lock} is gone"
+        ) from None
+    try:
+        if not (work_path / ".git").is_dir():
+            # Converted by another process meanwhile
+            return
+        status = _run_git(
+            work_path,
+            ["status", "--porcelain", "--untracked-files=all", "--ignored"],
+        )
+        if status:
+            raise RuntimeError(
+                f"{work_path} has files that are not committed, commit or "
+                "remove them before opening it"
+            )
+        # Moved out of the way first, checked out keys may be named like the
+        # files of a git directory ("config", "HEAD", ...)
+        git_dir = work_path.with_name(f".{work_path.name}.git")
+        (work_path / ".git").rename(git_dir)
+        shutil.rmtree(work_path)
+        git_dir.rename(work_path)
+        (work_path / "index").unlink(missing_ok=True)
+        _run_git(work_path, ["config", "core.bare", "true"])
+    finally:
+        lock.unlink()
+
+
+def _mtime_ns(path: Path) -> int | None:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _log_push_failure(future: Future) -> None:
+    # Unflushed failures would go unnoticed otherwise
+    error = future.exception()
+    if isinstance(error, subprocess.CalledProcessError):
+        logger.warning(
+            "Background push failed: %s", error.stderr.decode(errors="replace").strip()
+        )
+    elif error is not None:
+        logger.warning("Background push failed: %r", error)
+
+
 class GitConfigRepo(ConfigRepo):
-    def __init__(self, work_path: str | Path, remote_url: str, branch: str = "master"):
+    """
+    Config repo backed by a bare clone of a remote git repository.
+
+    There is no working tree: values are read from the object store and
+    commits are written into it directly, so nothing is ever checked out.
+    A `work_path` holding a clone with a working tree, as made by earlier
+    versions, is converted to a bare clone when opened.
+
+    `fetch_interval` is the minimum number of seconds between two fetches
+    of the same branch, reloads in between only look at the local clone.
+    A local branch that diverged from the remote, as after a rejected push,
+    gets the remote's changes merged in when fetched, like `merge` does.
+
+    With `background_push`, `commit` and `merge` return once the commit is
+    written locally and push it from a background thread. Call `flush` to
+    wait for the pushes and see their errors.
+
+    A failed push leaves the commit in the local clone and the branch in
+    `failed_pushes`, until `retry_push` or the next push of the branch
+    sends it.
+    """
+
+    def __init__(
+        self,
+        work_path: str | Path,
+        remote_url: str,
+        branch: str = "master",
+        fetch_interval: float = 0.0,
+        background_push: bool = False,
+    ):
         self.work_path = Path(work_path).absolute()
         self.remote_url = remote_url
         self.branch = branch
-
-        if not (self.work_path / ".git").exists():
+        self.fetch_interval = fetch_interval
+        # A single worker keeps pushes in commit order
+        self._push_executor = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="config-plane-push")
+            if background_push
+            else None
+        )
+        self._pending_pushes: set[Future] = set()
+        # Branch name -> error of its last push, if that failed
+        self._failed_pushes: dict[str, Exception] = {}
+        # Both are updated from the push thread
+        self._push_lock = threading.Lock()
+        # Branch name -> time.monotonic() of its last fetch
+        self._fetched_at: dict[str, float] = {}
+        # Local branch names, dropped whenever we move refs ourselves
+        self._branches: list[str] | None = None
+        # Files and directories read for `_branches`, with their mtimes then
+        self._ref_mtimes: dict[Path, int | None] = {}
+
+        if (self.work_path / ".git").is_dir():
+            _convert_to_bare(self.work_path)
+        if not (self.work_path / "HEAD").exists():
             # Clone from remote
             self.work_path.parent.mkdir(parents=True, exist_ok=True)
             # We can't easily clone into an existing directory if it's not empty,
-            # but we assume work_path is managed by this tool.
+            # but we assume work_path is managed by this tool. Tags are never
+            # read. The full history is kept, merge() needs the merge base.
             _run_git(
                 self.work_path.parent,
-                ["clone", "-b", self.branch, self.remote_url, self.work_path.name],
+                [
+                    "clone",
+                    "--bare",
+                    "--no-tags",
+                    "-b",
+                    self.branch,
+                    self.remote_url,
+                    self.work_path.name,
+                ],
             )
-        else:
-            # Optionally verification of checking remote origin could go here
-            pass
 
-        # Ensure we are on the correct branch
-        current_branch = self._get_current_branch()
-        if current_branch != self.branch:
-            # If branch doesn't exist, we might need to checkout from remote
-            # But normally clone -b handles initial.
-            # If valid switching:
-            _run_git(self.work_path, ["checkout", self.branch])
+        # Shared by all snapshots of this repo for reading blobs
+        self._session = _GitSession(self.work_path)
+
+        # `base` and `stage` are loaded on first access, see below
 
+    @cached_property
+    def base(self) -> ConfigSnapshot:
         self.reload()
+        return self.base
 
-    def _get_current_branch(self) -> str:
+    @cached_property
+    def stage(self) -> GitConfigStage:
+        self.reload()
+        return self.stage
+
+    def _push(self) -> None:
+        if self._push_executor is None:
+            self._push_branch(self.branch)
+            return
+        future = self._push_executor.submit(self._push_branch, self.branch)
+        with self._push_lock:
+            self._pending_pushes.add(future)
+        future.add_done_callback(self._push_done)
+
+    def _push_branch(self, branch: str) -> None:
         try:
-            return _run_git(self.work_path, ["branch", "--show-current"])
-        except subprocess.CalledProcessError:
-            return ""
+            _run_git(self.work_path, ["push", "origin", branch])
+        except Exception as e:
+            with self._push_lock:
+                self._failed_pushes[branch] = e
+            raise
+        with self._push_lock:
+            self._failed_pushes.pop(branch, None)
+
+    def _push_done(self, future: Future) -> None:
+        with self._push_lock:
+            self._pending_pushes.discard(future)
+        _log_push_failure(future)
+
+    def _wait_for_pushes(self) -> None:
+        with self._push_lock:
+            pending = list(self._pending_pushes)
+        wait(pending)
+
+    @property
+    def failed_pushes(self) -> dict[str, Exception]:
+        """Branches whose last push failed, with the error it failed with."""
+        with self._push_lock:
+            return dict(self._failed_pushes)
+
+    def flush(self) -> None:
+        """
+        Wait for background pushes to finish.
 
-    def reload(self):
-        # Pull latest changes from remote
-        try:
-            # We try to pull. If it fails (e.g. no remote, or conflicts), we might raise or warn.
-            # For this strict config repo, let's raise if pull fails,
-            # EXCEPT if it's a fresh empty repo maybe?
-            # But standard git usage: pull origin <branch>
-            _run_git(self.work_path, ["pull", "origin", self.branch])
-        except subprocess.CalledProcessError:
-            # If offline or remote issue, what do we do?
-            # For now let's raise, as per "does not work with remote updates" requirement implication
-            pass
+        Raises the error of a branch whose last push failed. The commits stay
+        in the local clone, see `retry_push`.
+        """
+        self._wait_for_pushes()
+        errors = list(self.failed_pushes.values())
+        if errors:
+            raise errors[0]
 
+    def retry_push(self) -> None:
+        """
+        Push the branches in `failed_pushes` again, raises if one still fails.
+
+        A push rejected because another clone pushed first goes through
+        after a `reload`, which merges the remote's changes in.
+        """
+        self._wait_for_pushes()
+        for branch in self.failed_pushes:
+            self._push_branch(branch)
+
+    def _fetch(self, *branches: str) -> None:
+        # Our own commits must reach the remote before we fetch it again.
+        # Failed pushes are kept in `failed_pushes`, not raised from here.
+        self._wait_for_pushes()
+
+        now = time.monotonic()
+        due = [
+            branch
+            for branch in branches
+            if now - self._fetched_at.get(branch, -float("inf")) >= self.fetch_interval
+        ]
+        if not due:
+            return
+        self._fetched_at.update(dict.fromkeys(due, now))
+
+        # Ask the remote for its heads first and only fetch the branches it
+        # has moved. Most polls find nothing new, and ls-remote costs a
+        # fraction of a fetch that transfers nothing.
         try:
-            head_hash = _run_git(self.work_path, ["rev-parse", "HEAD"])
-            self.base = GitConfigSnapshot(self.work_path, head_hash)
-        except subprocess.CalledProcessError:
-            # Should not happen in valid git repo unless empty
+            out = _run_git(
+                self.work_path,
+                ["ls-remote", "--heads", "origin", *(f"refs/heads/{b}" for b in due)],
+            )
+        except subprocess.CalledProcessError as e:
+            # Offline. Keep working with the local state, but leave a trace.
+            logger.warning(
+                "Listing branches of origin failed: %s",
+                e.stderr.decode(errors="replace").strip(),
+            )
+            return
+        remote_heads = {}
+        for line in out.splitlines():
+            commit_hash, ref = line.split("\t", 1)
+            remote_heads[ref.removeprefix("refs/heads/")] = commit_hash
+        # Local heads along with the last fetched ones: a branch merged with
+        # the remote (see `_fetch_moved`) differs from it until it is pushed
+        heads = self._resolve_refs(
+            {f"refs/heads/{b}": b for b in due}
+            | {f"refs/remotes/origin/{b}": f"origin/{b}" for b in due}
+        )
+        moved = []
+        for branch in due:
+            known = (heads.get(branch), heads.get(f"origin/{branch}"))
+            # Branches missing on the remote only exist locally, nothing to fetch
+            if branch in remote_heads and remote_heads[branch] not in known:
+                moved.append(branch)
+        if not moved:
+            return
+        self._branches = None
+        self._fetch_moved(moved)
+
+    def _fetch_moved(self, branches: list[str]) -> None:
+        # A bare clone has no remote-tracking branches by default. The remote
+        # heads are fetched into refs/remotes/origin, whatever the local
+        # branches hold, and the local branches are updated from there.
+        try:
+            _run_git(
+                self.work_path,
+                [
+                    "fetch",
+                    "--no-tags",
+                    "origin",
+                    *(f"+refs/heads/{b}:refs/remotes/origin/{b}" for b in branches),
+                ],
+            )
+        except subprocess.CalledProcessError as e:
+            # Offline. Keep working with the local state, but leave a trace.
+            logger.warning(
+                "Fetching %s from origin failed: %s",
+                ", ".join(branches),
+                e.stderr.decode(errors="replace").strip(),
+            )
+            return
+        fetched = self._resolve_refs(
+            {f"refs/remotes/origin/{branch}": branch for branch in branches}
+        )
+        local_heads = self._resolve_branches(*branches)
+        for branch, theirs in fetched.items():
+            ours = local_heads.get(branch)
+            if ours is not None:
+                merge_base = _run_git(self.work_path, ["merge-base", ours, theirs])
+                if merge_base == theirs:
+                    # Only ahead of the remote, the next push sends it
+                    continue
+                if merge_base != ours:
+                    # Diverged, like after a push rejected because another
+                    # clone pushed first. The remote's changes are merged in,
+                    # see `_merge_commits`, and go out with the next push.
+                    self._merge_commits(
+                        branch, ours, theirs, merge_base, f"Merge origin/{branch}"
+                    )
+                    continue
+            _run_git(
+                self.work_path,
+                ["update-ref", f"refs/heads/{branch}", theirs, ours or ""],
+            )
+
+    def _resolve_refs(self, refs: Mapping[str, str]) -> dict[str, str]:
+        """Map the name given to each of `refs` that exists to its commit."""
+        out = _run_git(
+            self.work_path,
+            ["for-each-ref", "--format=%(objectname) %(refname)", *refs],
+        )
+        heads = {}
+        for line in out.splitlines():
+            commit_hash, ref = line.split(" ", 1)
+            # Patterns also match refs below them, like refs/heads/<branch>/x
+            if ref in refs:
+                heads[refs[ref]] = commit_hash
+        return heads
+
+    def _resolve_branches(self, *branches: str) -> dict[str, str]:
+        """Map each of `branches` that exists locally to its head commit."""
+        return self._resolve_refs({f"refs/heads/{b}": b for b in branches})
+
+    def _resolve_branch(self, branch: str) -> str | None:
+        return self._resolve_branches(branch).get(branch)
+
+    def reload(self) -> bool:
+        """Fetch the branch, returns True if it moved since the last load."""
+        self._fetch(self.branch)
+        return self._load_head()
+
+    def _load_head(self) -> bool:
+        head_hash = self._resolve_branch(self.branch)
+        # Looked up in __dict__ so a first load doesn't recurse into `stage`
+        previous = self.__dict__.get("stage")
+        if (
+            previous is not None
+            and previous.branch == self.branch
+            and isinstance(previous.snapshot, GitConfigSnapshot)
+            and previous.snapshot.commit_hash == head_hash
+        ):
+            # Nothing new, keep the snapshot along with the values it cached
+            return False
+
+        if head_hash is not None:
+            self.base = GitConfigSnapshot(self.work_path, head_hash, self._session)
+        else:
+            # A branch without commits yet
             self.base = MemoryConfigSnapshot({})
 
-        self.stage = GitConfigStage(self.work_path, getattr(self, "base", None))  # type: ignore
+        stage = GitConfigStage(self.work_path, self.branch, self.base, self._session)
+        # Keep uncommitted changes staged on top of the refreshed base
+        if previous is not None:
+            stage.data = previous.data
+        self.stage = stage
+        return True
+
+    def close(self) -> None:
+        """
+        Stop the background git process shared by this repo's snapshots.
+
+        Pending background pushes are waited for, see `flush`.
+        """
+        if self._push_executor is not None:
+            self._push_executor.shutdown()
+            self.flush()
+        self._session.close()
 
     def get(self, key: str) -> Blob | None:
         return self.stage.get(key)
 
+    def get_many(self, keys: Iterable[str]) -> dict[str, Blob | None]:
+        return self.stage.get_many(keys)
+
+    def get_into(self, key: str, out: BlobBuffer) -> int | None:
+        return self.stage.get_into(key, out)
+
     def set(self, key: str, value: Blob | None) -> None:
         self.stage.set(key, value)
 
@@ -179,105 +853,143 @@ class GitConfigRepo(ConfigRepo):
 
     def commit(self) -> None:
         self.base = self.stage.freeze()
-        # After freeze, push changes
-        _run_git(self.work_path, ["push", "origin", self.branch])
-
-        self.stage = GitConfigStage(self.work_path, self.base)
+        # The commit may have created the branch
+        self._branches = None
+        # Committed locally, a failed push must not leave the changes staged
+        self.stage = GitConfigStage(
+            self.work_path, self.branch, self.base, self._session
+        )
+        self._push()
 
     def switch_branch(self, branch: str) -> None:
         if self.is_dirty():
             raise RuntimeError("Cannot switch branch with dirty stage")
 
-        # Checkout logic
-        # If branch exists locally: checkout
-        # If not, checkout -b ... origin/...
-
-        # Simple attempt:
-        try:
-            _run_git(self.work_path, ["checkout", branch])
-        except subprocess.CalledProcessError:
-            # Try checkout tracking remote
-            _run_git(self.work_path, ["checkout", "-b", branch, f"origin/{branch}"])
+        # Branches that only exist on the remote are fetched on the way
+        self._fetch(branch)
+        if self._resolve_branch(branch) is None:
+            raise ValueError(f"Branch '{branch}' does not exist")
 
         self.branch = branch
-        self.reload()
+        self._load_head()
 
     def create_branch(self, new_branch: str, from_branch: str | None = None) -> None:
         start_point = from_branch or self.branch
-        if start_point == self.branch:
-            _run_git(self.work_path, ["checkout", "-b", new_branch])
-        else:
-            _run_git(self.work_path, ["branch", new_branch, start_point])
-
-        # If we just created it locally, we should probably push it upstream?
-        # Standard flow: create local, work, commit, push -u.
-        # But here we might want immediate existence on remote?
-        # Let's keep it simple: create local. commit() will push.
-        # Wait, commit() does `git push origin <branch>`.
-        # So we need to ensure upstream is set or just explicit push.
-        pass
+        # Only creates the ref, commit() pushes it upstream
+        _run_git(self.work_path, ["branch", new_branch, start_point])
+        self._branches = None
 
     def list_branches(self) -> list[str]:
-        # List remote branches too?
-        # git branch -a
-        out = _run_git(self.work_path, ["branch", "--format=%(refname:short)"])
-        return out.splitlines()
+        if (self.work_path / "reftable").is_dir():
+            # Refs are not plain files with the reftable backend, ask git
+            out = _run_git(
+                self.work_path,
+                ["for-each-ref", "--format=%(refname:lstrip=2)", "refs/heads"],
+            )
+            return sorted(out.splitlines())
+        # Refs are read from disk rather than asking git. Other processes
+        # sharing the clone write loose refs and pack them, any of that
+        # changes the mtime of packed-refs or of a directory below
+        # refs/heads, so those are checked before the cache is used.
+        if self._branches is None or any(
+            _mtime_ns(path) != mtime for path, mtime in self._ref_mtimes.items()
+        ):
+            self._branches, self._ref_mtimes = self._scan_branches()
+        return list(self._branches)
+
+    def _scan_branches(self) -> tuple[list[str], dict[Path, int | None]]:
+        # Taken before reading, a change during the scan shows on the next call
+        mtimes: dict[Path, int | None] = {}
+        branches = set()
+        packed_refs = self.work_path / "packed-refs"
+        mtimes[packed_refs] = _mtime_ns(packed_refs)
+        try:
+            with open(packed_refs, encoding="utf-8") as f:
+                for line in f:
+                    # Skip the header and peeled tags ("^<oid>")
+                    if line.startswith(("#", "^")):
+                        continue
+                    ref = line.rstrip("\n").split(" ", 1)[1]
+                    if ref.startswith("refs/heads/"):
+                        branches.add(ref.removeprefix("refs/heads/"))
+        except FileNotFoundError:
+            pass
+
+        # Loose refs, branch names may contain slashes
+        heads = self.work_path / "refs" / "heads"
+        pending = [heads]
+        while pending:
+            directory = pending.pop()
+            mtimes[directory] = _mtime_ns(directory)
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_dir():
+                    pending.append(Path(entry.path))
+                elif not entry.name.endswith(".lock"):
+                    branches.add(Path(entry.path).relative_to(heads).as_posix())
+        return sorted(branches), mtimes
 
     def merge(self, branch: str) -> None:
         """
-        Merge the specified branch into the current branch using git merge.
+        Merge the specified branch into the current branch.
+
+        Every key changed on `branch` since the common ancestor takes its
+        value from `branch`, like `git merge -X theirs` but per key. The merge
+        commit is pushed right away.
         """
-        # Ensure we have the latest state of the source branch
-        # GitConfigRepo works with remotes mostly
-        # self.branch is already "pulled" in reload()
-        # But `branch` might be remote only?
-        # We assume `branch` is the name, e.g. "dev" or "origin/dev".
-        # If user passes "dev", and we are on "prod", we might need to fetch origin.
-
-        # Always fetch to be safe?
-        _run_git(self.work_path, ["fetch", "origin"])
-
-        # Try to resolve branch to something mergeable
-        # If it exists locally, use it. If not, try origin/<branch>
-
-        merge_target = branch
-        # Check if local branch exists
-        branches = self.list_branches()
-        if branch not in branches:
-            # Check if origin/branch exists
-            # Simply try merging origin/branch?
-            # Or assume user passed "origin/dev" if they meant remote?
-            # User intent: merge(branch="dev") usually means "dev".
-            # If dev is not local, we try origin/dev.
-            merge_target = f"origin/{branch}"
-
-        # Execute merge
-        # -m message
-        try:
+        self._fetch(branch, self.branch)
+        heads = self._resolve_branches(branch, self.branch)
+        theirs = heads.get(branch)
+        if theirs is None:
+            raise ValueError(f"Branch '{branch}' does not exist")
+        ours = heads.get(self.branch)
+
+        if ours is None:
+            new_hash = theirs
+        else:
+            merge_base = _run_git(self.work_path, ["merge-base", ours, theirs])
+            if merge_base == theirs:
+                # Already merged
+                return
+            if merge_base == ours:
+                # Fast-forward
+                new_hash = theirs
+            else:
+                new_hash = self._merge_commits(
+                    self.branch, ours, theirs, merge_base, f"Merge {branch}"
+                )
+
+        if new_hash == theirs:
             _run_git(
                 self.work_path,
-                ["merge", merge_target, "-m", f"Merge {branch}", "-X", "theirs"],
+                ["update-ref", f"refs/heads/{self.branch}", theirs, ours or ""],
             )
-        except subprocess.CalledProcessError as e:
-            # Conflict or failure
-            raise RuntimeError(f"Merge failed: {e.stderr or e.output}")
+        self._branches = None
+        self._load_head()
+        self._push()
 
-        # Update our internal state
-        # Merge usually commits automatically if no conflict.
-        # But our repo object maintains `self.base` and `self.stage`.
-        # `reload()` will refresh base to HEAD and reset stage.
-        self.reload()
+    def _merge_commits(
+        self, branch: str, ours: str, theirs: str, merge_base: str, message: str
+    ) -> str:
+        """
+        Commit `theirs` merged into `ours` on `branch`, returns the new hash.
 
-        # We should push immediately?
-        # Specification for SQL says "creating a snapshot... in the end apply".
-        # For Git repo: `commit()` pushes.
-        # `merge` creates a commit (usually).
-        # Does `merge` imply push in our abstraction?
-        # Our `commit()` pushes. If `merge` creates a commit, we should probably push it.
-        # Or leave it to user to call `commit()`? But `commit()` only commits STAGED changes.
-        # If `merge` committed already, `commit()` might do nothing (stage empty).
-        # We need to ensure push.
-        _run_git(self.work_path, ["push", "origin", self.branch])
+        Every key changed in `theirs` since `merge_base` takes its value from
+        there, the other keys keep the values of `ours`.
+        """
+        diff = _diff_tree(self.work_path, merge_base, theirs)
+        changed = [key for status, key in diff if status != b"D"]
+        changes: dict[str, Blob | None] = dict.fromkeys(key for _, key in diff)
+        changes.update(
+            zip(
+                changed,
+                self._session.read_many([f"{theirs}:{k}" for k in changed]),
+            )
+        )
+        return _write_commit(self.work_path, branch, [ours, theirs], changes, message)
 
     def _repr_pretty_(self, p: Any, cycle: bool) -> None:
         if cycle:
@@ -293,6 +1005,16 @@ class GitConfigRepo(ConfigRepo):
 
 
 def create_git_config_repo(
-    work_path: str | Path, remote_url: str, branch: str = "master"
+    work_path: str | Path,
+    remote_url: str,
+    branch: str = "master",
+    fetch_interval: float = 0.0,
+    background_push: bool = False,
 ) -> GitConfigRepo:
-    return GitConfigRepo(work_path, remote_url=remote_url, branch=branch)
+    return GitConfigRepo(
+        work_path,
+        remote_url=remote_url,
+        branch=branch,
+        fetch_interval=fetch_interval,
+        background_push=background_push,
+    )
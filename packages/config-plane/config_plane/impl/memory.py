@@ -1,14 +1,71 @@
+import hashlib
+import sys
+from collections import ChainMap
+from collections.abc import Mapping
 from typing import Any
+from weakref import WeakValueDictionary
+
+from config_plane.base import (
+    ConfigRepo,
+    ConfigSnapshot,
+    ConfigStage,
+    Blob,
+    SnapshotDiff,
+)
+
+MemorySnapshotData = Mapping[str, Blob]
+
+# Marks a key deleted in a stage or overlay without touching the parent data.
+_TOMBSTONE: Any = object()
+# Default for single-lookup dict.get() calls, where None is a valid value
+_MISS: Any = object()
+
+# Larger data is summarized in pretty reprs instead of printed in full
+_PRETTY_MAX_KEYS = 32
+
+
+def _pretty_data(p: Any, data: MemorySnapshotData) -> None:
+    if len(data) > _PRETTY_MAX_KEYS:
+        p.text(f"<{len(data)} keys>")
+    else:
+        # Deletions are shown as None, like they are passed to `set`
+        p.pretty(
+            {key: None if value is _TOMBSTONE else value for key, value in data.items()}
+        )
+
+
+# Snapshot digests are the sum of per-item hashes modulo this. Summing makes
+# the digest independent of key order and lets freeze() update it from the
+# changed keys only.
+_DIGEST_MOD = 1 << 256
+
+
+def _item_digest(key: str, value: Blob) -> int:
+    encoded = key.encode()
+    h = hashlib.blake2b(len(encoded).to_bytes(8, "little"), digest_size=32)
+    h.update(encoded)
+    h.update(value)
+    return int.from_bytes(h.digest(), "little")
 
-from config_plane.base import ConfigRepo, ConfigSnapshot, ConfigStage, Blob
 
-MemoryRepoData = dict[str, dict[str, Blob]]
-MemorySnapshotData = dict[str, Blob]
+def _live_items(data: MemorySnapshotData) -> dict[str, Blob]:
+    return {k: v for k, v in data.items() if v is not _TOMBSTONE}
+
+
+def _live_view(data: MemorySnapshotData) -> Mapping[str, Blob]:
+    # Only chained snapshots carry tombstones, collapsed ones are plain dicts
+    return _live_items(data) if isinstance(data, ChainMap) else data
 
 
 class MemoryConfigSnapshot(ConfigSnapshot):
-    def __init__(self, data: MemorySnapshotData) -> None:
+    __slots__ = ("data", "digest", "__weakref__")
+
+    def __init__(self, data: MemorySnapshotData, digest: int | None = None) -> None:
         self.data = data
+        # Content hash, equal for snapshots holding the same items
+        if digest is None:
+            digest = sum(_item_digest(k, v) for k, v in _live_items(data).items())
+        self.digest = digest % _DIGEST_MOD
 
     def _repr_pretty_(self, p: Any, cycle: bool) -> None:
         if cycle:
@@ -16,14 +73,41 @@ class MemoryConfigSnapshot(ConfigSnapshot):
         else:
             with p.group(4, "ConfigSnapshot(", ")"):
                 p.breakable()
-                p.text(f"data={self.data},")
+                p.text("data=")
+                _pretty_data(p, self.data)
+                p.text(",")
                 p.breakable()
 
     def get(self, key: str) -> Blob | None:
-        return self.data.get(key)
+        value = self.data.get(key)
+        if value is _TOMBSTONE:
+            return None
+        return value
+
+    def diff(self, other: ConfigSnapshot) -> SnapshotDiff:
+        if other is self:
+            return SnapshotDiff()
+        if not isinstance(other, MemoryConfigSnapshot):
+            raise TypeError("Can only diff against another MemoryConfigSnapshot")
+
+        # Key views support set operations in C, values are compared as bytes
+        new, old = _live_view(self.data), _live_view(other.data)
+        return SnapshotDiff(
+            added=new.keys() - old.keys(),
+            removed=old.keys() - new.keys(),
+            changed={k for k in new.keys() & old.keys() if new[k] != old[k]},
+        )
+
+
+# Branch name -> head snapshot. Snapshots are immutable, so branches share
+# them by reference. Plain mappings are still accepted and get wrapped into
+# a snapshot on first use.
+MemoryRepoData = dict[str, MemoryConfigSnapshot | MemorySnapshotData]
 
 
 class MemoryConfigStage(ConfigStage):
+    __slots__ = ("snapshot", "data")
+
     def __init__(self, snapshot: MemoryConfigSnapshot) -> None:
         self.snapshot = snapshot
         self.data: MemorySnapshotData = {}
@@ -39,44 +123,98 @@ class MemoryConfigStage(ConfigStage):
                 p.text(",")
                 p.breakable()
                 p.text("data=")
-                p.pretty(self.data)
+                _pretty_data(p, self.data)
                 p.breakable()
 
     def get(self, key: str) -> Blob | None:
-        if key in self.data:
-            return self.data[key]
-        else:
+        value = self.data.get(key, _MISS)
+        if value is _MISS:
             return self.snapshot.get(key)
+        return None if value is _TOMBSTONE else value
 
     def set(self, key: str, value: Blob | None) -> None:
-        if value is None:
-            if key in self.data:
-                del self.data[key]
-        else:
-            self.data[key] = value
+        # Interned keys are shared by all snapshots of a long-lived repo
+        # instead of each set() keeping its own copy of the string
+        key = sys.intern(key)
+        # bytes() is a no-op for bytes, but detaches mutable buffers
+        # (bytearray, memoryview) so frozen snapshots can share the value
+        self.data[key] = _TOMBSTONE if value is None else bytes(value)
 
     def is_dirty(self) -> bool:
         return len(self.data) > 0
 
-    def freeze(self) -> ConfigSnapshot:
-        return MemoryConfigSnapshot(
-            {
-                **self.snapshot.data,
-                **self.data,
-            }
-        )
+    def freeze(self) -> MemoryConfigSnapshot:
+        digest = self.snapshot.digest
+        for key, value in self.data.items():
+            previous = self.snapshot.get(key)
+            if previous is not None:
+                digest -= _item_digest(key, previous)
+            if value is not _TOMBSTONE:
+                digest += _item_digest(key, value)
+
+        # Frozen snapshots are layered over their parent instead of being
+        # copied. Layers are kept at least twice as large as the one above
+        # them by merging a layer into the one below when it grows too big,
+        # like an LSM tree. That bounds the chain at O(log N) layers while each
+        # key is copied O(log N) times overall. Shared layers are never
+        # mutated, merges build new dicts with the C-level dict |.
+        base = self.snapshot.data
+        parents = base.maps if isinstance(base, ChainMap) else [base]
+        layers = [dict(self.data), *parents]
+        while len(layers) > 1 and 2 * len(layers[0]) > len(layers[1]):
+            merged = layers[1] | layers[0]
+            del layers[:2]
+            if not layers:
+                # Nothing left below for tombstones to hide
+                merged = _live_items(merged)
+            layers.insert(0, merged)
+
+        if len(layers) == 1:
+            return MemoryConfigSnapshot(layers[0], digest)
+        return MemoryConfigSnapshot(ChainMap(*layers), digest)
 
 
 class MemoryConfigRepo(ConfigRepo):
+    __slots__ = ("repo", "branch", "base", "stage", "_interned")
+
     def __init__(self, repo_data: MemoryRepoData, branch: str = "master") -> None:
         self.repo = repo_data
         self.branch = branch
+        # Live snapshots by digest, so commits that end up with the same
+        # contents (reverts, no-op changes) share a single snapshot
+        self._interned: WeakValueDictionary[int, MemoryConfigSnapshot] = (
+            WeakValueDictionary()
+        )
 
         self.reload()
 
-    def reload(self) -> None:
-        self.base = MemoryConfigSnapshot(self.repo.get(self.branch, {}))
+    def _branch_snapshot(self, branch: str) -> MemoryConfigSnapshot:
+        head = self.repo.get(branch)
+        if head is None:
+            return MemoryConfigSnapshot({})
+        if not isinstance(head, MemoryConfigSnapshot):
+            head = MemoryConfigSnapshot(head)
+            self.repo[branch] = head
+        return head
+
+    def _intern(self, snapshot: MemoryConfigSnapshot) -> MemoryConfigSnapshot:
+        existing = self._interned.get(snapshot.digest)
+        if existing is snapshot:
+            return existing
+        # Digests are only compared in full on a hit, which is rare
+        if existing is not None and _live_items(existing.data) == _live_items(
+            snapshot.data
+        ):
+            return existing
+        self._interned[snapshot.digest] = snapshot
+        return snapshot
+
+    def reload(self) -> bool:
+        """Re-read the branch, returns True if it moved since the last load."""
+        previous = getattr(self, "base", None)
+        self.base = self._intern(self._branch_snapshot(self.branch))
         self.stage = MemoryConfigStage(self.base)
+        return self.base is not previous
 
     def _repr_pretty_(self, p: Any, cycle: bool) -> None:
         if cycle:
@@ -108,9 +246,8 @@ class MemoryConfigRepo(ConfigRepo):
         if not self.stage.is_dirty():
             return
 
-        new_base = self.stage.freeze()
-        assert isinstance(new_base, MemoryConfigSnapshot)
-        self.repo[self.branch] = new_base.data
+        new_base = self._intern(self.stage.freeze())
+        self.repo[self.branch] = new_base
         self.base = new_base
 
         self.stage = MemoryConfigStage(self.base)
@@ -133,9 +270,8 @@ class MemoryConfigRepo(ConfigRepo):
             # Actually repo_data is passed in.
             pass
 
-        data = self.repo.get(source, {})
-        # Deep copy needed? Blobs are bytes (immutable), dict shallow copy is enough
-        self.repo[new_branch] = data.copy()
+        # Snapshots are immutable, the new branch shares the source head
+        self.repo[new_branch] = self._branch_snapshot(source)
 
     def list_branches(self) -> list[str]:
         return list(self.repo.keys())
@@ -145,9 +281,10 @@ class MemoryConfigRepo(ConfigRepo):
             raise ValueError(f"Branch '{branch}' does not exist")
 
         # Simple overlay merge: copy everything from source to stage
-        source_data = self.repo[branch]
+        source_data = self._branch_snapshot(branch).data
         for key, value in source_data.items():
-            self.stage.set(key, value)
+            if value is not _TOMBSTONE:
+                self.stage.set(key, value)
 
 
 def create_memory_config_repo(repo: MemoryRepoData) -> MemoryConfigRepo:
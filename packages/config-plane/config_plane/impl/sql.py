@@ -1,15 +1,57 @@
-from typing import Callable, Any
+import functools
+import hashlib
+import threading
+import zlib
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from contextlib import contextmanager
+from typing import Callable, Any, TypeVar
 
 
 from sqlalchemy import (
     LargeBinary,
     ForeignKey,
+    Index,
+    Integer,
+    CTE,
+    Column,
+    Connection,
+    DefaultClause,
+    Engine,
+    Select,
+    bindparam,
+    case,
+    delete,
+    event,
+    exists,
+    func,
+    inspect,
+    literal,
+    or_,
     select,
     insert,
+    text,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm import (
+    DeclarativeBase,
+    Session,
+    aliased,
+    relationship,
+    Mapped,
+    mapped_column,
 )
-from sqlalchemy.orm import DeclarativeBase, Session, relationship, Mapped, mapped_column
 
-from config_plane.base import ConfigRepo, ConfigSnapshot, ConfigStage, Blob
+from config_plane.base import (
+    ConfigRepo,
+    ConfigSnapshot,
+    ConfigStage,
+    Blob,
+    SnapshotDiff,
+)
+from config_plane.impl.cache import BlobCache
 
 
 class Base(DeclarativeBase):
@@ -20,6 +62,11 @@ class BlobModel(Base):
     __tablename__ = "blobs"
     id: Mapped[int] = mapped_column(primary_key=True)
     content: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    # BLAKE2b of the value before encoding. Blobs are immutable and shared by
+    # every item with the same value.
+    content_sha: Mapped[bytes] = mapped_column(LargeBinary(32), unique=True)
+    # How content is stored, see `_encode_blob`
+    codec: Mapped[int] = mapped_column(default=0, server_default="0")
 
 
 class SnapshotModel(Base):
@@ -29,17 +76,39 @@ class SnapshotModel(Base):
         ForeignKey("snapshots.id"), nullable=True
     )
     committed: Mapped[bool] = mapped_column(default=False)
+    # Number of layers above the nearest snapshot that holds all of its keys,
+    # 0 for such a full snapshot. See `_MAX_CHAIN_DEPTH`.
+    depth: Mapped[int] = mapped_column(default=0, server_default="0")
+    # The other parent of a merge, see `SqlConfigRepo.merge`
+    merge_parent_id: Mapped[int | None] = mapped_column(
+        ForeignKey("snapshots.id"), nullable=True
+    )
 
 
 class SnapshotItemModel(Base):
     __tablename__ = "snapshot_items"
+    # Reads filter on the primary key and only need blob_id, so they should
+    # be answered from an index alone. SQLite and InnoDB get there by
+    # clustering the table on its primary key, PostgreSQL needs an index
+    # that carries blob_id.
+    __table_args__ = (
+        Index(
+            "ix_snapshot_items_cover",
+            "snapshot_id",
+            "key",
+            postgresql_include=["blob_id"],
+        ).ddl_if(dialect="postgresql"),
+        {"sqlite_with_rowid": False},
+    )
     snapshot_id: Mapped[int] = mapped_column(
         ForeignKey("snapshots.id"), primary_key=True
     )
     key: Mapped[str] = mapped_column(primary_key=True)
     blob_id: Mapped[int | None] = mapped_column(ForeignKey("blobs.id"), nullable=True)
 
-    blob: Mapped[BlobModel] = relationship(BlobModel)
+    # Reads join blobs explicitly. Lazy loading would issue a query per item,
+    # so it raises instead of silently turning a read into N+1 queries.
+    blob: Mapped[BlobModel | None] = relationship(BlobModel, lazy="raise")
 
 
 class BranchModel(Base):
@@ -48,10 +117,457 @@ class BranchModel(Base):
     snapshot_id: Mapped[int] = mapped_column(ForeignKey("snapshots.id"))
 
 
+# Version of the tables above, bumped whenever they change in a way that a
+# database created for an earlier version can't be used as it is. Version 1
+# is the original schema, from before versions were recorded.
+SCHEMA_VERSION = 2
+
+
+class SchemaVersionModel(Base):
+    __tablename__ = "schema_version"
+    version: Mapped[int] = mapped_column(primary_key=True)
+
+
+# Reads of a single key. The statements are built once with bound parameters,
+# so a read skips constructing the select and SQLAlchemy's compiled cache
+# lookup is the only per-call overhead.
+#
+# Plain columns instead of ORM entities, reads skip the identity map. The hot
+# single-key reads also run on the session's connection rather than through
+# Session.execute, which skips the ORM execution layer entirely.
+# A row with a NULL blob_id is a deletion, no row means not set at all.
+_SELECT_ITEM: Select[tuple[int | None, bytes | None, int | None]] = (
+    select(SnapshotItemModel.blob_id, BlobModel.content, BlobModel.codec)
+    .outerjoin(BlobModel, SnapshotItemModel.blob_id == BlobModel.id)
+    .where(
+        SnapshotItemModel.snapshot_id == bindparam("snapshot_id"),
+        SnapshotItemModel.key == bindparam("key"),
+    )
+)
+# Same, but the key may also come from `parent_id`, which `snapshot_id` wins
+# over.
+_SELECT_ITEM_OVER_PARENT: Select[tuple[int | None, bytes | None, int | None]] = (
+    select(SnapshotItemModel.blob_id, BlobModel.content, BlobModel.codec)
+    .outerjoin(BlobModel, SnapshotItemModel.blob_id == BlobModel.id)
+    .where(
+        SnapshotItemModel.snapshot_id.in_(
+            [bindparam("snapshot_id"), bindparam("parent_id")]
+        ),
+        SnapshotItemModel.key == bindparam("key"),
+    )
+    .order_by(
+        case((SnapshotItemModel.snapshot_id == bindparam("snapshot_id"), 0), else_=1)
+    )
+    .limit(1)
+)
+
+
+# Upper bound for the values of one IN (...) list, well below the bound
+# parameter limits of SQLite and PostgreSQL
+_MAX_IN_VALUES = 500
+
+
+# Committed snapshots only store the keys changed since their parent, with a
+# NULL blob_id for deletions, so a commit writes O(changes) rows. Reads
+# combine the layers up to the nearest full snapshot. Every
+# _MAX_CHAIN_DEPTH commits a snapshot is written out in full again, which
+# bounds the layers a read has to combine.
+_MAX_CHAIN_DEPTH = 16
+
+
+def _snapshot_chain() -> CTE:
+    """
+    The layers that make up the committed snapshot bound to `chain_id`,
+    `level` 0 is its own.
+    """
+    chain = (
+        select(
+            SnapshotModel.id,
+            SnapshotModel.parent_id,
+            SnapshotModel.depth,
+            literal(0).label("level"),
+        )
+        .where(SnapshotModel.id == bindparam("chain_id"))
+        .cte("chain", recursive=True)
+    )
+    layer = aliased(SnapshotModel)
+    return chain.union_all(
+        select(layer.id, layer.parent_id, layer.depth, chain.c.level + 1)
+        .join(chain, layer.id == chain.c.parent_id)
+        # Stop below the nearest full snapshot
+        .where(chain.c.depth > 0)
+    )
+
+
+_CHAIN = _snapshot_chain()
+# Key, blob_id and content of every layer of the snapshot. The farthest layer
+# comes first, so collecting the rows into a dict lets nearer layers win.
+_SELECT_CHAIN_ITEMS: Select[tuple[str, int | None, bytes | None, int | None]] = (
+    select(
+        SnapshotItemModel.key,
+        SnapshotItemModel.blob_id,
+        BlobModel.content,
+        BlobModel.codec,
+    )
+    .join(_CHAIN, SnapshotItemModel.snapshot_id == _CHAIN.c.id)
+    .outerjoin(BlobModel, SnapshotItemModel.blob_id == BlobModel.id)
+    .order_by(_CHAIN.c.level.desc())
+)
+_SELECT_CHAIN_BLOB_IDS: Select[tuple[str, int | None]] = (
+    _SELECT_CHAIN_ITEMS.with_only_columns(
+        SnapshotItemModel.key, SnapshotItemModel.blob_id
+    )
+)
+
+# Copy the keys of the snapshot bound to `chain_id` into `snapshot_id`,
+# except those it already has. Done server-side with INSERT ... SELECT, no
+# rows reach the client. The nearest layer wins for every key. NOT EXISTS
+# rather than NOT IN: planners turn it into an anti-join (a primary key lookup
+# per parent row), and it has no NULL pitfalls.
+_LAYERS = (
+    select(
+        SnapshotItemModel.key,
+        SnapshotItemModel.blob_id,
+        func.row_number()
+        .over(partition_by=SnapshotItemModel.key, order_by=_CHAIN.c.level)
+        .label("rank"),
+    )
+    .join(_CHAIN, SnapshotItemModel.snapshot_id == _CHAIN.c.id)
+    .subquery()
+)
+_STAGED = aliased(SnapshotItemModel)
+# A Core insert on the table: the ORM would read the parameters as row values
+_COPY_CHAIN_ITEMS = insert(SnapshotItemModel.__table__).from_select(
+    ["snapshot_id", "key", "blob_id"],
+    select(
+        bindparam("snapshot_id", type_=Integer), _LAYERS.c.key, _LAYERS.c.blob_id
+    ).where(
+        _LAYERS.c.rank == 1,
+        _LAYERS.c.blob_id.is_not(None),
+        ~exists().where(
+            _STAGED.snapshot_id == bindparam("snapshot_id"),
+            _STAGED.key == _LAYERS.c.key,
+        ),
+    ),
+)
+
+
+def _ancestry(name: str, snapshot_param: str) -> CTE:
+    """
+    The snapshot bound to `snapshot_param` and every snapshot it descends
+    from, through merges as well.
+    """
+    ancestry = (
+        select(
+            SnapshotModel.id, SnapshotModel.parent_id, SnapshotModel.merge_parent_id
+        )
+        .where(SnapshotModel.id == bindparam(snapshot_param))
+        .cte(name, recursive=True)
+    )
+    parent = aliased(SnapshotModel)
+    # UNION rather than UNION ALL, history joined by a merge is walked once
+    return ancestry.union(
+        select(parent.id, parent.parent_id, parent.merge_parent_id).join(
+            ancestry,
+            or_(
+                parent.id == ancestry.c.parent_id,
+                parent.id == ancestry.c.merge_parent_id,
+            ),
+        )
+    )
+
+
+_OURS = _ancestry("ours", "ours_id")
+_THEIRS = _ancestry("theirs", "theirs_id")
+_COMMON = (
+    select(_THEIRS).where(_THEIRS.c.id.in_(select(_OURS.c.id))).cte("common")
+)
+_LATER = _COMMON.alias("later")
+# The lowest common ancestors: common ancestors that are no parent of another
+# one. Ids can't tell, a stage's id is taken when it opens, possibly before
+# its merge parent was committed. The ancestors of a common ancestor are
+# common ancestors too, so checking direct parents is enough. Criss-cross
+# histories have several, the highest id is taken to stay deterministic.
+_SELECT_MERGE_BASE: Select[tuple[int]] = (
+    select(_COMMON.c.id)
+    .where(
+        ~exists().where(
+            or_(
+                _LATER.c.parent_id == _COMMON.c.id,
+                _LATER.c.merge_parent_id == _COMMON.c.id,
+            )
+        )
+    )
+    .order_by(_COMMON.c.id.desc())
+    .limit(1)
+)
+
+# The rest of the statements run once per read or per commit
+_SELECT_BLOB: Select[tuple[bytes, int]] = select(
+    BlobModel.content, BlobModel.codec
+).where(BlobModel.id == bindparam("blob_id"))
+_STAGE_HAS_ITEMS: Select[tuple[bool]] = select(
+    exists().where(SnapshotItemModel.snapshot_id == bindparam("snapshot_id"))
+)
+_SELECT_DEPTH: Select[tuple[int]] = select(SnapshotModel.depth).where(
+    SnapshotModel.id == bindparam("snapshot_id")
+)
+_SELECT_BRANCH_SNAPSHOT: Select[tuple[int]] = select(BranchModel.snapshot_id).where(
+    BranchModel.name == bindparam("branch")
+)
+
+
+# Default bound on the blob contents a repo keeps in memory
+_BLOB_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def _blob_sha(content: Blob) -> bytes:
+    return hashlib.blake2b(content, digest_size=32).digest()
+
+
+# Values for BlobModel.codec
+_CODEC_RAW = 0
+_CODEC_ZLIB = 1
+# Smaller values are stored as they are, compressing them saves next to nothing
+_COMPRESS_MIN_BYTES = 128
+
+
+def _encode_blob(content: Blob) -> tuple[bytes, int]:
+    """
+    Stored form of a blob and its codec.
+
+    Config values are mostly text that compresses several times over, which
+    cuts the bytes every read moves. Values that don't shrink are kept raw.
+    """
+    if len(content) >= _COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(content)
+        if len(compressed) < len(content):
+            return compressed, _CODEC_ZLIB
+    return content, _CODEC_RAW
+
+
+def _decode_blob(payload: bytes | None, codec: int | None) -> Blob | None:
+    """Inverse of `_encode_blob`, None stays None for outer-joined rows."""
+    if payload is not None and codec == _CODEC_ZLIB:
+        return zlib.decompress(payload)
+    return payload
+
+
+def _store_blobs(session: Session, contents: Iterable[Blob]) -> dict[bytes, int]:
+    """
+    Make sure a blob exists for each of `contents`.
+
+    Returns blob ids by content sha. Existing blobs are looked up with IN
+    lists of bounded size and the missing ones inserted as a single
+    executemany, which SQLAlchemy batches into multi-row INSERT ... RETURNING
+    statements that stay within the bound parameter limits.
+    """
+    # Blobs are content-addressed, identical values share a single row
+    by_sha = {_blob_sha(content): content for content in contents}
+    if not by_sha:
+        return {}
+    shas = list(by_sha)
+    ids: dict[bytes, int] = {}
+    for start in range(0, len(shas), _MAX_IN_VALUES):
+        stmt = select(BlobModel.content_sha, BlobModel.id).where(
+            BlobModel.content_sha.in_(shas[start : start + _MAX_IN_VALUES])
+        )
+        ids.update({sha: blob_id for sha, blob_id in session.execute(stmt)})
+    missing = []
+    for sha, content in by_sha.items():
+        if sha not in ids:
+            payload, codec = _encode_blob(content)
+            missing.append({"content": payload, "codec": codec, "content_sha": sha})
+    if not missing:
+        return ids
+    dialect = session.get_bind().dialect
+    if dialect.name not in ("sqlite", "postgresql"):
+        # No portable way to skip rows that exist. Another writer may insert
+        # the same blob between our lookup and insert, the unique sha then
+        # rejects the batch: undo it and start over, the lookup finds the
+        # other writer's rows this time.
+        try:
+            with session.begin_nested():
+                session.execute(insert(BlobModel.__table__), missing)
+        except IntegrityError:
+            return _store_blobs(session, by_sha.values())
+    else:
+        # Another writer may insert the same blob between our lookup and
+        # insert, its row serves us as well
+        insert_blobs = sqlite_insert if dialect.name == "sqlite" else postgresql_insert
+        stmt = insert_blobs(BlobModel).on_conflict_do_nothing(
+            index_elements=[BlobModel.content_sha]
+        )
+        if dialect.insert_executemany_returning:
+            # RETURNING hands back the new ids without flushing ORM objects
+            rows = session.execute(
+                stmt.returning(BlobModel.content_sha, BlobModel.id), missing
+            )
+            ids.update({sha: blob_id for sha, blob_id in rows})
+        else:
+            session.execute(stmt, missing)
+    # Ids not handed back, because there is no RETURNING (MySQL) or another
+    # writer inserted the row, are read back by sha
+    new_shas = [row["content_sha"] for row in missing if row["content_sha"] not in ids]
+    for start in range(0, len(new_shas), _MAX_IN_VALUES):
+        stmt = select(BlobModel.content_sha, BlobModel.id).where(
+            BlobModel.content_sha.in_(new_shas[start : start + _MAX_IN_VALUES])
+        )
+        ids.update({sha: blob_id for sha, blob_id in session.execute(stmt)})
+    return ids
+
+
+def _upsert_items(
+    session: Session, snapshot_id: int, blob_ids: Mapping[str, int | None]
+) -> None:
+    rows = [
+        {"snapshot_id": snapshot_id, "key": key, "blob_id": blob_id}
+        for key, blob_id in blob_ids.items()
+    ]
+    if not rows:
+        return
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        stmt = sqlite_insert(SnapshotItemModel)
+    elif dialect == "postgresql":
+        stmt = postgresql_insert(SnapshotItemModel)
+    else:
+        # No portable upsert. Rather than letting the ORM look up and merge
+        # row by row, drop the keys that are already there and insert all
+        # rows as one executemany that bypasses the unit of work.
+        keys = list(blob_ids)
+        for start in range(0, len(keys), _MAX_IN_VALUES):
+            session.execute(
+                delete(SnapshotItemModel).where(
+                    SnapshotItemModel.snapshot_id == snapshot_id,
+                    SnapshotItemModel.key.in_(keys[start : start + _MAX_IN_VALUES]),
+                )
+            )
+        session.execute(insert(SnapshotItemModel.__table__), rows)
+        return
+    # Executed with the rows as parameters (executemany) rather than as a
+    # multi-row VALUES, so large batches don't exceed the parameter limit
+    session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[SnapshotItemModel.snapshot_id, SnapshotItemModel.key],
+            set_={"blob_id": stmt.excluded.blob_id},
+        ),
+        rows,
+    )
+
+
+def _check_schema(session: Session) -> None:
+    """
+    Raise RuntimeError unless the database has the tables of `SCHEMA_VERSION`.
+
+    A database without any version yet is stamped with the current one if
+    it is empty, a database with data was created by the original schema.
+    """
+    try:
+        stmt = select(func.max(SchemaVersionModel.version))
+        version = session.execute(stmt).scalar()
+    except DBAPIError as e:
+        raise RuntimeError(
+            "The database has no schema_version table, it was created for an "
+            "older version of config-plane or not created at all. Upgrade it "
+            "with config_plane.impl.sql.migrate_schema(engine), or create the "
+            "tables with Base.metadata.create_all."
+        ) from e
+    if version is None:
+        has_data = select(exists().where(SnapshotModel.id.is_not(None)))
+        if session.execute(has_data).scalar():
+            version = 1
+        else:
+            try:
+                with session.begin_nested():
+                    session.add(SchemaVersionModel(version=SCHEMA_VERSION))
+            except IntegrityError:
+                # Stamped by another writer at the same time
+                pass
+            version = SCHEMA_VERSION
+    if version != SCHEMA_VERSION:
+        raise RuntimeError(
+            f"The database has schema version {version}, this version of "
+            f"config-plane needs {SCHEMA_VERSION}. Upgrade it with "
+            "config_plane.impl.sql.migrate_schema(engine)."
+        )
+
+
+def _session_lock(session: Session) -> threading.RLock:
+    # One per session, shared by the repo and its snapshots and stages: a
+    # session must not be used by two threads at once
+    return session.info.setdefault("config_plane.lock", threading.RLock())
+
+
+_Method = TypeVar("_Method", bound=Callable[..., Any])
+
+
+def _reads(method: _Method) -> _Method:
+    """Run a method of an object with a `session` attribute under its lock."""
+
+    @functools.wraps(method)
+    def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+        with _session_lock(self.session):
+            return method(self, *args, **kwargs)
+
+    return wrapper  # type: ignore[return-value]
+
+
+@contextmanager
+def _writing(session: Session) -> Iterator[Session]:
+    """Commit what the block writes to `session`, roll it back on errors."""
+    with _session_lock(session):
+        try:
+            yield session
+        except BaseException:
+            session.rollback()
+            raise
+        session.commit()
+
+
+def _read_items(
+    session: Session, snapshot_id: int, keys: Sequence[str]
+) -> dict[str, Blob | None]:
+    """Content of those `keys` that have an item in the snapshot, None if deleted."""
+    found: dict[str, Blob | None] = {}
+    for start in range(0, len(keys), _MAX_IN_VALUES):
+        stmt = (
+            select(SnapshotItemModel.key, BlobModel.content, BlobModel.codec)
+            .outerjoin(BlobModel, SnapshotItemModel.blob_id == BlobModel.id)
+            .where(
+                SnapshotItemModel.snapshot_id == snapshot_id,
+                SnapshotItemModel.key.in_(keys[start : start + _MAX_IN_VALUES]),
+            )
+        )
+        found.update(
+            {
+                key: _decode_blob(content, codec)
+                for key, content, codec in session.execute(stmt)
+            }
+        )
+    return found
+
+
 class SqlConfigSnapshot(ConfigSnapshot):
-    def __init__(self, session_maker: Callable[[], Session], snapshot_id: int) -> None:
-        self.session_maker = session_maker
+    def __init__(
+        self,
+        session: Session,
+        snapshot_id: int,
+        committed: bool = False,
+        blob_cache: BlobCache | None = None,
+    ) -> None:
+        # Shared with the repo, see `SqlConfigRepo`
+        self.session = session
         self.snapshot_id = snapshot_id
+        # Committed snapshots never change, so their flattened key -> blob_id
+        # mapping and the blobs read from them can be kept in memory. Blob
+        # rows never change either, so the blob cache is keyed by id and
+        # may be shared by all snapshots of a repo.
+        self.committed = committed
+        self._items: dict[str, int | None] | None = None
+        if blob_cache is None:
+            blob_cache = BlobCache(_BLOB_CACHE_BYTES)
+        self._blobs = blob_cache
 
     def _repr_pretty_(self, p: Any, cycle: bool) -> None:
         if cycle:
@@ -62,42 +578,116 @@ class SqlConfigSnapshot(ConfigSnapshot):
                 p.text(f"id={self.snapshot_id},")
                 p.breakable()
 
+    @_reads
     def get(self, key: str) -> Blob | None:
-        with self.session_maker() as session:
-            stmt = select(SnapshotItemModel).where(
-                SnapshotItemModel.snapshot_id == self.snapshot_id,
-                SnapshotItemModel.key == key,
-            )
-            item = session.execute(stmt).scalar_one_or_none()
-            if item is None:
-                return None
-            if item.blob_id is None:
-                return None
+        if not self.committed:
+            params = {"snapshot_id": self.snapshot_id, "key": key}
+            row = self.session.connection().execute(_SELECT_ITEM, params).first()
+            return _decode_blob(row.content, row.codec) if row is not None else None
 
-            # We need to fetch the blob content.
-            # Since we have the relationship accessed, we might need it eagerly loaded or just query it.
-            # But item.blob is Mapped[BlobModel], so accessing it lazily should work if session is active.
-            # However, to be safe and explicit:
-            if item.blob:
-                return item.blob.content
+        blob_id = self._load_items().get(key)
+        if blob_id is None:
+            return None
+        content = self._blobs.get(blob_id)
+        if content is None:
+            params = {"blob_id": blob_id}
+            row = self.session.connection().execute(_SELECT_BLOB, params).one()
+            content = _decode_blob(row.content, row.codec)
+            self._blobs.put(blob_id, content)
+        return content
+
+    @_reads
+    def get_many(self, keys: Iterable[str]) -> dict[str, Blob | None]:
+        keys = list(keys)
+        if not self.committed:
+            found = _read_items(self.session, self.snapshot_id, keys)
+            return {key: found.get(key) for key in keys}
+
+        items = self._load_items()
+        blobs: dict[int, Blob] = {}
+        missing = []
+        for blob_id in {items.get(key) for key in keys} - {None}:
+            content = self._blobs.get(blob_id)
+            if content is None:
+                missing.append(blob_id)
+            else:
+                blobs[blob_id] = content
+        for start in range(0, len(missing), _MAX_IN_VALUES):
+            stmt = select(BlobModel.id, BlobModel.content, BlobModel.codec).where(
+                BlobModel.id.in_(missing[start : start + _MAX_IN_VALUES])
+            )
+            rows = [
+                (blob_id, _decode_blob(content, codec))
+                for blob_id, content, codec in self.session.execute(stmt)
+            ]
+            # Served from what was read, the cache may not hold all of it
+            blobs.update({blob_id: content for blob_id, content in rows})
+            self._blobs.update(rows)
+        return {
+            key: None if (blob_id := items.get(key)) is None else blobs[blob_id]
+            for key in keys
+        }
+
+    @_reads
+    def _load_items(self) -> dict[str, int | None]:
+        if self._items is None:
+            rows = self.session.execute(
+                _SELECT_CHAIN_BLOB_IDS, {"chain_id": self.snapshot_id}
+            )
+            items = {key: blob_id for key, blob_id in rows}
+            # Deletions only matter while layers are combined
+            items = {k: blob_id for k, blob_id in items.items() if blob_id}
+            if not self.committed:
+                # Still changing, read again next time
+                return items
+            self._items = items
+        return self._items
+
+    def diff(self, other: ConfigSnapshot) -> SnapshotDiff:
+        if other is self:
+            return SnapshotDiff()
+        if not isinstance(other, SqlConfigSnapshot):
+            raise TypeError("Can only diff against another SqlConfigSnapshot")
+
+        # Blobs are stored once per content, equal ids mean equal values
+        new, old = self._load_items(), other._load_items()
+        return SnapshotDiff(
+            added=new.keys() - old.keys(),
+            removed=old.keys() - new.keys(),
+            changed={k for k in new.keys() & old.keys() if new[k] != old[k]},
+        )
 
-            # Fallback if relation not loaded but id is present
-            blob_stmt = select(BlobModel).where(BlobModel.id == item.blob_id)
-            blob = session.execute(blob_stmt).scalar_one_or_none()
-            return blob.content if blob else None
+    @_reads
+    def load_all(self) -> dict[str, Blob]:
+        """Read every key of the snapshot with a single query."""
+        rows = self.session.execute(
+            _SELECT_CHAIN_ITEMS, {"chain_id": self.snapshot_id}
+        )
+        layered = {
+            key: (blob_id, _decode_blob(content, codec))
+            for key, blob_id, content, codec in rows
+        }
+        # Deleted keys read as missing either way
+        rows = {key: row for key, row in layered.items() if row[0] is not None}
+        if self.committed:
+            self._items = {key: blob_id for key, (blob_id, _) in rows.items()}
+            self._blobs.update(rows.values())
+        return {key: content for key, (_, content) in rows.items()}
 
 
 class SqlConfigStage(ConfigStage):
     def __init__(
         self,
-        session_maker: Callable[[], Session],
+        session: Session,
         parent_snapshot: SqlConfigSnapshot | None,
         stage_snapshot_id: int,
     ) -> None:
-        self.session_maker = session_maker
+        self.session = session
         self.parent = parent_snapshot
         self.snapshot_id = stage_snapshot_id
         self.merge_parent_id: int | None = None
+        # Known after the first is_dirty() query or set(), None until then
+        self._dirty: bool | None = None
 
     def _repr_pretty_(self, p: Any, cycle: bool) -> None:
         if cycle:
@@ -111,91 +701,64 @@ class SqlConfigStage(ConfigStage):
                 p.pretty(self.parent)
                 p.breakable()
 
+    @_reads
     def get(self, key: str) -> Blob | None:
-        with self.session_maker() as session:
-            # Check current sparse snapshot first
-            stmt = select(SnapshotItemModel).where(
-                SnapshotItemModel.snapshot_id == self.snapshot_id,
-                SnapshotItemModel.key == key,
-            )
-            item = session.execute(stmt).scalar_one_or_none()
-
-            if item is not None:
-                # Explicitly set in this stage
-                if item.blob_id is None:
-                    return None  # Deleted
-
-                if item.blob:
-                    return item.blob.content
-
-                blob_stmt = select(BlobModel).where(BlobModel.id == item.blob_id)
-                blob = session.execute(blob_stmt).scalar_one_or_none()
-                return blob.content if blob else None
-
-            # Not found in stage, check parent
-            if self.parent:
-                return self.parent.get(key)
-
-            return None
+        # The sparse stage wins over its parent. A committed parent combines
+        # its own layers (see `_finalize_commit`) and answers from its cache,
+        # otherwise it is checked in the same query as the stage.
+        parent = self.parent
+        cached_parent = parent is not None and parent.committed
+        params = {"snapshot_id": self.snapshot_id, "key": key}
+        stmt = _SELECT_ITEM
+        if parent is not None and not cached_parent:
+            params["parent_id"] = parent.snapshot_id
+            stmt = _SELECT_ITEM_OVER_PARENT
+        row = self.session.connection().execute(stmt, params).first()
+        if row is not None:
+            # content is None for keys deleted in the stage
+            return _decode_blob(row.content, row.codec)
+        if cached_parent:
+            return parent.get(key)  # type: ignore[union-attr]
+        return None
+
+    @_reads
+    def get_many(self, keys: Iterable[str]) -> dict[str, Blob | None]:
+        keys = list(keys)
+        values = _read_items(self.session, self.snapshot_id, keys)
+        # Keys not in the sparse stage come from the parent
+        rest = [key for key in keys if key not in values]
+        if rest and self.parent is not None:
+            values.update(self.parent.get_many(rest))
+        return {key: values.get(key) for key in keys}
 
     def set(self, key: str, value: Blob | None) -> None:
-        with self.session_maker() as session:
-            stmt = select(SnapshotItemModel).where(
-                SnapshotItemModel.snapshot_id == self.snapshot_id,
-                SnapshotItemModel.key == key,
+        self.set_many({key: value})
+
+    def set_many(self, items: Mapping[str, Blob | None]) -> None:
+        if not items:
+            return
+        with _writing(self.session) as session:
+            blob_ids = _store_blobs(
+                session, (value for value in items.values() if value is not None)
             )
-            item = session.execute(stmt).scalar_one_or_none()
-
-            if item:
-                # Item exists in stage
-                if value is None:
-                    item.blob_id = None
-                else:
-                    # Update existing blob in place
-                    if item.blob_id is not None:
-                        blob_stmt = select(BlobModel).where(
-                            BlobModel.id == item.blob_id
-                        )
-                        blob = session.execute(blob_stmt).scalar_one_or_none()
-                        if blob:
-                            blob.content = value
-                        else:
-                            # Should not happen ideally
-                            new_blob = BlobModel(content=value)
-                            session.add(new_blob)
-                            session.flush()
-                            item.blob_id = new_blob.id
-                    else:
-                        # Was deleted, now setting value -> create new blob
-                        new_blob = BlobModel(content=value)
-                        session.add(new_blob)
-                        session.flush()
-                        item.blob_id = new_blob.id
-            else:
-                # Item missing in stage, create new entry
-                blob_id = None
-                if value is not None:
-                    new_blob = BlobModel(content=value)
-                    session.add(new_blob)
-                    session.flush()
-                    blob_id = new_blob.id
-
-                new_item = SnapshotItemModel(
-                    snapshot_id=self.snapshot_id, key=key, blob_id=blob_id
-                )
-                session.add(new_item)
-
-            session.flush()
-            session.commit()
+            _upsert_items(
+                session,
+                self.snapshot_id,
+                {
+                    key: None if value is None else blob_ids[_blob_sha(value)]
+                    for key, value in items.items()
+                },
+            )
+        self._dirty = True
 
+    @_reads
     def is_dirty(self) -> bool:
-        with self.session_maker() as session:
-            # Check if any items exist in the sparse snapshot
-            stmt = select(SnapshotItemModel).where(
-                SnapshotItemModel.snapshot_id == self.snapshot_id
-            )
-            result = session.execute(stmt).first()
-            return result is not None
+        if self._dirty is not None:
+            return self._dirty
+        # Check if any items exist in the sparse snapshot
+        params = {"snapshot_id": self.snapshot_id}
+        self._dirty = bool(self.session.execute(_STAGE_HAS_ITEMS, params).scalar())
+        return self._dirty
 
     def freeze(self) -> ConfigSnapshot:
         # This implementation of freeze is slightly different than memory one because
@@ -205,50 +768,47 @@ class SqlConfigStage(ConfigStage):
         # If we need a frozen snapshot, we would technically need to commit or fork?
         # The base interface says `freeze() -> ConfigSnapshot`.
         # For now, let's treat the current stage view as a snapshot read.
-        return SqlConfigSnapshot(self.session_maker, self.snapshot_id)
+        return SqlConfigSnapshot(self.session, self.snapshot_id)
 
     def _finalize_commit(self, session: Session) -> None:
-        """Helper to fill in gaps from parent before marking committed."""
+        """
+        Mark the stage committed, on top of its parent.
+
+        Usually the stage's rows, deletions included, are kept as they are,
+        as a layer over the parent. Once the parent's chain reaches
+        `_MAX_CHAIN_DEPTH` the parent's keys are copied in instead and the
+        snapshot stands on its own again.
+        """
+        depth = 0
         if self.parent:
-            # Copy items from parent that are NOT in current snapshot
-            # Insert into snapshot_items (snapshot_id, key, blob_id)
-            # Select key, blob_id from snapshot_items where snapshot_id = parent_id
-            # AND key NOT IN (select key from snapshot_items where snapshot_id = current_id)
-
-            parent_items_stmt = (
-                select(SnapshotItemModel.key, SnapshotItemModel.blob_id)
-                .where(SnapshotItemModel.snapshot_id == self.parent.snapshot_id)
-                .where(
-                    SnapshotItemModel.key.not_in(
-                        select(SnapshotItemModel.key).where(
-                            SnapshotItemModel.snapshot_id == self.snapshot_id
-                        )
-                    )
+            params = {"snapshot_id": self.parent.snapshot_id}
+            parent_depth = session.execute(_SELECT_DEPTH, params).scalar_one()
+            depth = parent_depth + 1
+
+        if depth >= _MAX_CHAIN_DEPTH:
+            # Copy the parent's items that are NOT in the stage
+            params = {
+                "chain_id": self.parent.snapshot_id,  # type: ignore[union-attr]
+                "snapshot_id": self.snapshot_id,
+            }
+            session.execute(_COPY_CHAIN_ITEMS, params)
+            depth = 0
+        if depth == 0:
+            # A full snapshot has nothing below it to delete keys from
+            session.execute(
+                delete(SnapshotItemModel).where(
+                    SnapshotItemModel.snapshot_id == self.snapshot_id,
+                    SnapshotItemModel.blob_id.is_(None),
                 )
             )
 
-            # Using bulk insert via connection/core if possible or manual
-            # To be DB-agnostic and safe within ORM session:
-            rows_to_insert = session.execute(parent_items_stmt).all()
-            if rows_to_insert:
-                session.execute(
-                    insert(SnapshotItemModel),
-                    [
-                        {
-                            "snapshot_id": self.snapshot_id,
-                            "key": row.key,
-                            "blob_id": row.blob_id,
-                        }
-                        for row in rows_to_insert
-                    ],
-                )
-
         # Mark as committed
-        snap = session.execute(
-            select(SnapshotModel).where(SnapshotModel.id == self.snapshot_id)
-        ).scalar_one()
-        snap.committed = True
-        session.flush()
+        session.execute(
+            update(SnapshotModel)
+            .where(SnapshotModel.id == self.snapshot_id)
+            .values(committed=True, depth=depth)
+        )
+        self._dirty = False
 
 
 class SqlConfigRepo(ConfigRepo):
@@ -257,45 +817,58 @@ class SqlConfigRepo(ConfigRepo):
         session_maker: Callable[[], Session],
         stage_snapshot_id: int | None = None,
         branch: str = "master",
+        cache_bytes: int = _BLOB_CACHE_BYTES,
     ) -> None:
         self.session_maker = session_maker
+        # One session for the lifetime of the repo, shared by its snapshots
+        # and stages, so reads don't each check out a connection and run
+        # their own transaction. The read transaction stays open until the
+        # next reload(), write or close(): poll reload() to bound how long a
+        # connection sits idle in it. Every call holds the session's lock.
+        self.session = session_maker()
         self.branch = branch
         self.parent_snapshot: SqlConfigSnapshot | None = None
+        # Blob contents read by any of the repo's committed snapshots, so a
+        # new snapshot after a commit or reload doesn't start out cold
+        self._blob_cache = BlobCache(cache_bytes)
 
-        with self.session_maker() as session:
+        with _writing(self.session) as session:
+            _check_schema(session)
             if stage_snapshot_id:
                 # Resuming
                 self.stage_snapshot_id = stage_snapshot_id
                 # Determine parent from the snapshot
-                snap = session.execute(
-                    select(SnapshotModel).where(SnapshotModel.id == stage_snapshot_id)
-                ).scalar_one()
+                # Primary key lookup, answered from the identity map if loaded
+                snap = session.get(SnapshotModel, stage_snapshot_id)
+                if snap is None:
+                    raise ValueError(f"Snapshot {stage_snapshot_id} does not exist")
                 if snap.committed:
                     raise ValueError("Cannot resume a committed snapshot as stage")
 
                 parent_id = snap.parent_id
                 self.parent_snapshot = (
-                    SqlConfigSnapshot(session_maker, parent_id) if parent_id else None
+                    self._committed_snapshot(parent_id) if parent_id else None
                 )
             else:
                 self._init_stage_from_branch(session)
 
-            session.commit()
-
         self.stage = SqlConfigStage(
-            self.session_maker, self.parent_snapshot, self.stage_snapshot_id
+            self.session, self.parent_snapshot, self.stage_snapshot_id
+        )
+
+    def _committed_snapshot(self, snapshot_id: int) -> SqlConfigSnapshot:
+        return SqlConfigSnapshot(
+            self.session, snapshot_id, committed=True, blob_cache=self._blob_cache
         )
 
     def _init_stage_from_branch(self, session: Session) -> None:
         # Try to get branch
-        branch_model = session.execute(
-            select(BranchModel).where(BranchModel.name == self.branch)
-        ).scalar_one_or_none()
+        branch_model = session.get(BranchModel, self.branch)
 
         parent_id = None
         if branch_model:
             parent_id = branch_model.snapshot_id
-            self.parent_snapshot = SqlConfigSnapshot(self.session_maker, parent_id)
+            self.parent_snapshot = self._committed_snapshot(parent_id)
         else:
             self.parent_snapshot = None
 
@@ -317,77 +890,81 @@ class SqlConfigRepo(ConfigRepo):
                 p.pretty(self.stage)
                 p.breakable()
 
+    def close(self) -> None:
+        """Close the repo's session, returning its connection to the pool."""
+        self.session.close()
+
     def get(self, key: str) -> Blob | None:
         return self.stage.get(key)
 
+    def get_many(self, keys: Iterable[str]) -> dict[str, Blob | None]:
+        return self.stage.get_many(keys)
+
     def set(self, key: str, value: Blob | None) -> None:
         self.stage.set(key, value)
 
+    def set_many(self, items: Mapping[str, Blob | None]) -> None:
+        self.stage.set_many(items)
+
     def is_dirty(self) -> bool:
         return self.stage.is_dirty()
 
     def commit(self) -> None:
-        with self.session_maker() as session:
+        with _writing(self.session) as session:
             # Finalize the stage
             self.stage._finalize_commit(session)
 
-            # Update branch
-            branch_model = session.execute(
-                select(BranchModel).where(BranchModel.name == self.branch)
-            ).scalar_one_or_none()
-
-            if branch_model:
-                branch_model.snapshot_id = self.stage_snapshot_id
-            else:
-                branch_model = BranchModel(
-                    name=self.branch, snapshot_id=self.stage_snapshot_id
+            # Move the branch without loading it first, it only has to be
+            # created on the first commit
+            moved = session.execute(
+                update(BranchModel)
+                .where(BranchModel.name == self.branch)
+                .values(snapshot_id=self.stage_snapshot_id)
+            )
+            if moved.rowcount == 0:
+                session.add(
+                    BranchModel(name=self.branch, snapshot_id=self.stage_snapshot_id)
                 )
-            session.add(branch_model)
 
             # Start new stage from this new commit
             parent_id = self.stage_snapshot_id
-            self.parent_snapshot = SqlConfigSnapshot(self.session_maker, parent_id)
+            self.parent_snapshot = self._committed_snapshot(parent_id)
 
-            new_snap = SnapshotModel(parent_id=parent_id, committed=False)
-            session.add(new_snap)
-            session.flush()
-            self.stage_snapshot_id = new_snap.id
+            self.stage_snapshot_id = session.execute(
+                insert(SnapshotModel)
+                .values(parent_id=parent_id, committed=False)
+                .returning(SnapshotModel.id)
+            ).scalar_one()
 
             self.stage = SqlConfigStage(
-                self.session_maker, self.parent_snapshot, self.stage_snapshot_id
+                self.session, self.parent_snapshot, self.stage_snapshot_id
             )
+            # The new stage is known to be empty
+            self.stage._dirty = False
 
-            session.commit()
-
+    @_reads
     def switch_branch(self, branch: str) -> None:
         if self.is_dirty():
             raise RuntimeError("Cannot switch branch with dirty stage")
 
         self.branch = branch
 
-        with self.session_maker() as session:
+        with _writing(self.session) as session:
             self._init_stage_from_branch(session)
-            session.commit()
 
         self.stage = SqlConfigStage(
-            self.session_maker, self.parent_snapshot, self.stage_snapshot_id
+            self.session, self.parent_snapshot, self.stage_snapshot_id
         )
 
     def create_branch(self, new_branch: str, from_branch: str | None = None) -> None:
-        with self.session_maker() as session:
+        with _writing(self.session) as session:
             # Check if already exists
-            existing = session.execute(
-                select(BranchModel).where(BranchModel.name == new_branch)
-            ).scalar_one_or_none()
-            if existing:
+            if session.get(BranchModel, new_branch) is not None:
                 raise ValueError(f"Branch '{new_branch}' already exists")
 
             source_name = from_branch or self.branch
-            source = session.execute(
-                select(BranchModel).where(BranchModel.name == source_name)
-            ).scalar_one_or_none()
-
-            snapshot_id = source.snapshot_id if source else None
+            source = session.get(BranchModel, source_name)
+            snapshot_id = source.snapshot_id if source is not None else None
 
             if snapshot_id is None and source_name != "master":
                 # If source doesn't exist AND it's not master (which might be implicit empty)
@@ -416,37 +993,239 @@ class SqlConfigRepo(ConfigRepo):
 
             new_branch_model = BranchModel(name=new_branch, snapshot_id=snapshot_id)
             session.add(new_branch_model)
-            session.commit()
 
+    @_reads
+    def merge(self, branch: str) -> None:
+        """
+        Stage the changes made on `branch` since the common ancestor.
+
+        Every key changed on `branch` takes its value from there, like the
+        git backend's merge. Values are staged by blob id, no content is
+        read or written. Commit the stage to record the merge.
+        """
+        theirs_id = self.session.execute(
+            _SELECT_BRANCH_SNAPSHOT, {"branch": branch}
+        ).scalar_one_or_none()
+        if theirs_id is None:
+            raise ValueError(f"Branch '{branch}' does not exist")
+
+        base_id = None
+        if self.parent_snapshot is not None:
+            params = {
+                "ours_id": self.parent_snapshot.snapshot_id,
+                "theirs_id": theirs_id,
+            }
+            base_id = self.session.execute(_SELECT_MERGE_BASE, params).scalar()
+            if base_id == theirs_id:
+                # Already merged
+                return
+
+        theirs = self._committed_snapshot(theirs_id)._load_items()
+        base = self._committed_snapshot(base_id)._load_items() if base_id else {}
+        changes: dict[str, int | None] = {
+            key: blob_id for key, blob_id in theirs.items() if base.get(key) != blob_id
+        }
+        changes.update((key, None) for key in base.keys() - theirs.keys())
+
+        with _writing(self.session) as session:
+            _upsert_items(session, self.stage_snapshot_id, changes)
+            session.execute(
+                update(SnapshotModel)
+                .where(SnapshotModel.id == self.stage_snapshot_id)
+                .values(merge_parent_id=theirs_id)
+            )
+        self.stage.merge_parent_id = theirs_id
+        if changes:
+            self.stage._dirty = True
+
+    @_reads
     def list_branches(self) -> list[str]:
         stmt = select(BranchModel.name)
-        with self.session_maker() as session:
-            return list(session.execute(stmt).scalars().all())
-
-    def reload(self) -> None:
-        with self.session_maker() as session:
-            """Reload the repository state from the storage."""
-            # Refresh branch pointer
-            branch_model = session.execute(
-                select(BranchModel).where(BranchModel.name == self.branch)
-            ).scalar_one_or_none()
-
-            parent_id = None
-            if branch_model:
-                parent_id = branch_model.snapshot_id
-                # Optimization: could check if self.parent_snapshot.id == parent_id
-                # But creating SqlConfigSnapshot is cheap.
-                self.parent_snapshot = SqlConfigSnapshot(self.session_maker, parent_id)
-            else:
-                self.parent_snapshot = None
+        return list(self.session.execute(stmt).scalars().all())
+
+    @_reads
+    def reload(self) -> bool:
+        """
+        Reload the repository state from the storage.
+
+        Returns True if the branch moved since the last load.
+        """
+        # End the read transaction, so the branch is read as of now even
+        # under snapshot isolation
+        self.session.commit()
+        # Refresh branch pointer, a column read keeps this poll out of
+        # the identity map
+        parent_id = self.session.execute(
+            _SELECT_BRANCH_SNAPSHOT, {"branch": self.branch}
+        ).scalar_one_or_none()
 
-            # Update stage parent
-            self.stage.parent = self.parent_snapshot
+        current = self.parent_snapshot
+        if (current.snapshot_id if current is not None else None) == parent_id:
+            # Keep the current snapshot, and its cache, the branch has not moved
+            return False
+        if parent_id is not None:
+            self.parent_snapshot = self._committed_snapshot(parent_id)
+        else:
+            self.parent_snapshot = None
+
+        # Rebase the stage on the new head, in the database as well: the
+        # commit layers the stage over the parent its row points to
+        with _writing(self.session) as session:
+            session.execute(
+                update(SnapshotModel)
+                .where(SnapshotModel.id == self.stage_snapshot_id)
+                .values(parent_id=parent_id)
+            )
+        self.stage.parent = self.parent_snapshot
+        return True
+
+
+# Settings for file-backed SQLite databases. WAL lets readers run alongside a
+# writer and only needs an fsync at checkpoints with synchronous=NORMAL.
+# Writers that find the database locked wait up to busy_timeout ms rather
+# than failing right away.
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+def configure_sqlite(engine: Engine) -> None:
+    """
+    Set up every new connection of a SQLite `engine` for config repos:
+    WAL journal, a 5 s busy timeout, a 64 MiB page cache and memory-mapped
+    reads.
+
+    Does nothing for other databases.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in _SQLITE_PRAGMAS:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def migrate_schema(engine: Engine) -> None:
+    """
+    Upgrade the tables of a database created for an earlier version of
+    config-plane to `SCHEMA_VERSION`, in place and in one transaction.
+
+    Version 1 blobs get their hash and codec columns, and blobs with the same
+    content are merged into one. Its committed snapshots are full copies, so
+    they keep the default depth of 0. Does nothing for an up-to-date
+    database. Close the repos using the database first.
+    """
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        if not inspector.has_table(SnapshotModel.__tablename__):
+            raise RuntimeError(
+                "The database has no config-plane tables, create them with "
+                "Base.metadata.create_all"
+            )
+        SchemaVersionModel.__table__.create(connection, checkfirst=True)
+        version = connection.execute(
+            select(func.max(SchemaVersionModel.version))
+        ).scalar()
+        if version == SCHEMA_VERSION:
+            return
+        if version is not None:
+            raise RuntimeError(
+                f"Don't know how to migrate schema version {version} to "
+                f"{SCHEMA_VERSION}"
+            )
+        blob_columns = {c["name"] for c in inspector.get_columns("blobs")}
+        snapshot_columns = {c["name"] for c in inspector.get_columns("snapshots")}
+        blobs = BlobModel.__table__
+        snapshots = SnapshotModel.__table__
+        for table, columns in ((blobs, blob_columns), (snapshots, snapshot_columns)):
+            for column in table.columns:
+                if column.name not in columns:
+                    _add_column(connection, column)
+        if "content_sha" not in blob_columns:
+            _dedupe_blobs(connection)
+            Index("uq_blobs_content_sha", blobs.c.content_sha, unique=True).create(
+                connection
+            )
+        if connection.dialect.name == "postgresql":
+            for index in SnapshotItemModel.__table__.indexes:
+                index.create(connection, checkfirst=True)
+        connection.execute(
+            insert(SchemaVersionModel.__table__).values(version=SCHEMA_VERSION)
+        )
+
+
+def _add_column(connection: Connection, column: Column[Any]) -> None:
+    preparer = connection.dialect.identifier_preparer
+    ddl = (
+        f"ALTER TABLE {preparer.format_table(column.table)} "
+        f"ADD COLUMN {preparer.format_column(column)} "
+        f"{column.type.compile(dialect=connection.dialect)}"
+    )
+    if isinstance(column.server_default, DefaultClause):
+        # Fills the existing rows, so the column can be NOT NULL right away
+        ddl += f" DEFAULT {column.server_default.arg} NOT NULL"
+    for foreign_key in column.foreign_keys:
+        target = foreign_key.column
+        ddl += (
+            f" REFERENCES {preparer.format_table(target.table)} "
+            f"({preparer.format_column(target)})"
+        )
+    connection.execute(text(ddl))
+
+
+def _dedupe_blobs(connection: Connection) -> None:
+    """Fill in `content_sha`, keeping the oldest of the blobs that share one."""
+    blobs = BlobModel.__table__
+    items = SnapshotItemModel.__table__
+    kept: dict[bytes, int] = {}
+    replaced: dict[int, int] = {}
+    # Read everything first, the statements below must not run while the
+    # cursor is still open
+    rows = connection.execute(
+        select(blobs.c.id, blobs.c.content, blobs.c.codec).order_by(blobs.c.id)
+    )
+    for blob_id, content, codec in rows:
+        sha = _blob_sha(_decode_blob(content, codec) or b"")
+        if sha in kept:
+            replaced[blob_id] = kept[sha]
+        else:
+            kept[sha] = blob_id
+    if replaced:
+        connection.execute(
+            update(items)
+            .where(items.c.blob_id == bindparam("old_id"))
+            .values(blob_id=bindparam("new_id")),
+            [{"old_id": old, "new_id": new} for old, new in replaced.items()],
+        )
+        duplicates = list(replaced)
+        for start in range(0, len(duplicates), _MAX_IN_VALUES):
+            chunk = duplicates[start : start + _MAX_IN_VALUES]
+            connection.execute(delete(blobs).where(blobs.c.id.in_(chunk)))
+    if kept:
+        connection.execute(
+            update(blobs)
+            .where(blobs.c.id == bindparam("blob_id"))
+            .values(content_sha=bindparam("sha")),
+            [{"blob_id": blob_id, "sha": sha} for sha, blob_id in kept.items()],
+        )
 
 
 def create_sql_config_repo(
     session_maker: Callable[[], Session],
     stage_snapshot_id: int | None = None,
     branch: str = "master",
+    cache_bytes: int = _BLOB_CACHE_BYTES,
 ) -> SqlConfigRepo:
-    return SqlConfigRepo(session_maker, stage_snapshot_id, branch=branch)
+    return SqlConfigRepo(
+        session_maker, stage_snapshot_id, branch=branch, cache_bytes=cache_bytes
+    )
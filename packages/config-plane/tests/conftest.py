@@ -0,0 +1,67 @@
+import subprocess
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+
+from config_plane.impl.sql import Base
+from tests.test_repo_common import PROVIDER_IDS, PROVIDERS
+
+# Hash of the empty tree, which git knows without it being stored
+_EMPTY_TREE = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+
+
+@pytest.fixture(scope="session")
+def git_origin_template(tmp_path_factory) -> Path:
+    """
+    A bare origin with a single empty commit on master.
+
+    Built once per test run, tests copy it instead of running git to set up
+    their own.
+    """
+    path = tmp_path_factory.mktemp("origin")
+    subprocess.run(
+        ["git", "init", "--bare", "--initial-branch=master"],
+        cwd=path,
+        check=True,
+        capture_output=True,
+    )
+    # The commit is written straight into the bare repo, no clone needed
+    commit = subprocess.run(
+        ["git", "-c", "user.name=Test", "-c", "user.email=test@test"]
+        + ["commit-tree", "-m", "Init", _EMPTY_TREE],
+        cwd=path,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    subprocess.run(
+        ["git", "update-ref", "refs/heads/master", commit],
+        cwd=path,
+        check=True,
+    )
+    return path
+
+
+@pytest.fixture(scope="session")
+def sql_schema_template(tmp_path_factory) -> Path:
+    """
+    An SQLite database with the schema created and nothing else.
+
+    Built once per test run like `git_origin_template`, tests copy the file
+    instead of running create_all on a database of their own.
+    """
+    path = tmp_path_factory.mktemp("schema") / "config.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    return path
+
+
+@pytest.fixture(params=PROVIDERS, ids=PROVIDER_IDS)
+def repo_provider(request):
+    """A provider of each backend, closed after the test."""
+    templates = [request.getfixturevalue(name) for name in request.param.templates]
+    provider = request.param(*templates)
+    yield provider
+    provider.close()
@@ -0,0 +1,68 @@
+import sys
+import threading
+
+from config_plane.impl.cache import BlobCache, _ENTRY_OVERHEAD
+
+
+def test_blob_cache_evicts_least_recently_used():
+    cache = BlobCache(max_bytes=3 * (_ENTRY_OVERHEAD + 10))
+    cache.put("a", b"a" * 10)
+    cache.put("b", b"b" * 10)
+    cache.put("c", None)
+    assert cache.size == 3 * _ENTRY_OVERHEAD + 20
+
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get("a") == b"a" * 10
+    cache.put("d", b"d" * 10)
+    assert "b" not in cache
+    assert cache.get("c", b"default") is None
+    assert cache.get("b", b"default") == b"default"
+    assert [key for key, _ in cache.items()] == ["a", "d", "c"]
+    assert cache.size <= cache.max_bytes
+
+
+def test_blob_cache_replaces_and_skips_oversized():
+    cache = BlobCache(max_bytes=_ENTRY_OVERHEAD + 10)
+    cache.put("a", b"small")
+    cache.put("a", b"smaller")
+    assert len(cache) == 1
+    assert cache.size == _ENTRY_OVERHEAD + 7
+
+    # Too large to ever fit, the cache is left as it was
+    cache.put("big", b"x" * 11)
+    assert "big" not in cache
+    assert cache.get("a") == b"smaller"
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.size == 0
+
+
+def test_blob_cache_shared_between_threads():
+    # Switch threads as often as possible, to interleave gets and evictions
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        cache = BlobCache(max_bytes=2 * (_ENTRY_OVERHEAD + 64))
+        errors: list[Exception] = []
+
+        def churn(seed: int) -> None:
+            try:
+                for i in range(20000):
+                    key = (seed + i) % 5
+                    if cache.get(key) is None:
+                        cache.put(key, b"x" * 64)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=churn, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert errors == []
+    assert len(cache) <= 2
+    assert cache.size == len(cache) * (_ENTRY_OVERHEAD + 64)
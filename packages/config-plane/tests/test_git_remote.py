@@ -1,40 +1,26 @@
 import pytest
+import shutil
 import subprocess
 from pathlib import Path
-from config_plane.impl.git import create_git_config_repo, GitConfigRepo
+from config_plane.impl.git import (
+    create_git_config_repo,
+    GitConfigRepo,
+    GitConfigSnapshot,
+)
 
 
 @pytest.fixture
-def remote_repo(tmp_path):
+def remote_repo(tmp_path, git_origin_template):
     """Creates a bare git repo to serve as remote."""
     origin = tmp_path / "origin"
-    origin.mkdir()
-    subprocess.run(
-        ["git", "init", "--bare", "--initial-branch=master"],
-        cwd=origin,
-        check=True,
-        capture_output=True,
-    )
+    shutil.copytree(git_origin_template, origin)
+    return str(origin)
 
-    # Init commit
-    init_dir = tmp_path / "init"
-    init_dir.mkdir()
-    subprocess.run(
-        ["git", "clone", str(origin), "."],
-        cwd=init_dir,
-        check=True,
-        capture_output=True,
-    )
-    subprocess.run(["git", "config", "user.name", "Test"], cwd=init_dir, check=True)
-    subprocess.run(
-        ["git", "config", "user.email", "test@test"], cwd=init_dir, check=True
-    )
-    subprocess.run(
-        ["git", "commit", "--allow-empty", "-m", "Init"], cwd=init_dir, check=True
-    )
-    subprocess.run(["git", "push", "origin", "master"], cwd=init_dir, check=True)
 
-    return str(origin)
+def _git(cwd, *args) -> str:
+    return subprocess.run(
+        ["git", *args], cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout.strip()
 
 
 def test_git_remote_sync(tmp_path, remote_repo):
@@ -73,3 +59,389 @@ def test_git_remote_sync(tmp_path, remote_repo):
     assert repo_a.get("foo") == b"bar"  # Old state
     repo_a.reload()
     assert repo_a.get("foo") == b"baz"  # New state
+
+
+def test_git_snapshot_get(tmp_path, remote_repo):
+    repo = create_git_config_repo(tmp_path / "repo", remote_url=remote_repo)
+    repo.set("foo", b"bar")
+    repo.set("baz", b"qux")
+    repo.commit()
+
+    snapshot = repo.base
+    assert isinstance(snapshot, GitConfigSnapshot)
+    try:
+        assert snapshot.get("foo") == b"bar"
+        assert snapshot.get("baz") == b"qux"
+        assert snapshot.get("missing") is None
+        # Reads after a miss keep working on the same process
+        assert snapshot.get("foo") == b"bar"
+
+        # Repeated reads are served from the snapshot cache
+        assert dict(snapshot._cache.items()) == {
+            "foo": b"bar",
+            "baz": b"qux",
+            "missing": None,
+        }
+    finally:
+        snapshot.close()
+
+
+def test_git_snapshots_share_session(tmp_path, remote_repo):
+    repo = create_git_config_repo(tmp_path / "repo", remote_url=remote_repo)
+    repo.set("foo", b"bar")
+    repo.commit()
+    first = repo.base
+    assert first.get("foo") == b"bar"
+
+    repo.set("foo", b"baz")
+    repo.commit()
+    second = repo.base
+    assert second.get("foo") == b"baz"
+    assert first.get("foo") == b"bar"
+
+    # Both snapshots read through the repo's cat-file process
+    assert first._session is second._session
+    # Closing a snapshot leaves the shared process running for the others
+    first.close()
+    assert second._session._batch is not None
+
+    # Standalone snapshots own their process
+    standalone = GitConfigSnapshot(repo.work_path, second.commit_hash)
+    assert standalone.get("foo") == b"baz"
+    standalone.close()
+    assert standalone._session._batch is None
+
+
+def test_git_repo_is_bare(tmp_path, remote_repo):
+    repo = create_git_config_repo(tmp_path / "repo", remote_url=remote_repo)
+    repo.set("foo", b"bar")
+    repo.set("dir/nested", b"value")
+    repo.commit()
+
+    # Values only live in the object store, nothing is checked out
+    assert not (repo.work_path / "foo").exists()
+    assert not (repo.work_path / "dir").exists()
+    assert _git(repo.work_path, "rev-parse", "--is-bare-repository") == "true"
+    assert _git(repo.work_path, "show", "master:dir/nested") == "value"
+
+    # The commit was pushed from the bare clone
+    assert _git(remote_repo, "show", "master:foo") == "bar"
+
+
+def test_git_merge_per_key(tmp_path, remote_repo):
+    repo = create_git_config_repo(tmp_path / "repo", remote_url=remote_repo)
+    repo.set_many({"shared": b"v1", "ours": b"v1", "theirs": b"v1"})
+    repo.commit()
+
+    repo.create_branch("dev")
+    repo.switch_branch("dev")
+    repo.set_many({"shared": b"dev", "theirs": None, "added": b"dev"})
+    repo.commit()
+
+    repo.switch_branch("master")
+    repo.set_many({"shared": b"master", "ours": b"master"})
+    repo.commit()
+
+    repo.merge("dev")
+    assert repo.get_many(["shared", "ours", "theirs", "added"]) == {
+        "shared": b"dev",
+        "ours": b"master",
+        "theirs": None,
+        "added": b"dev",
+    }
+    parents = _git(repo.work_path, "rev-parse", "master^1", "master^2").split()
+    assert parents[1] == _git(repo.work_path, "rev-parse", "dev")
+
+    # Merging again is a no-op
+    head = repo.base.commit_hash
+    repo.merge("dev")
+    assert repo.base.commit_hash == head
+
+
+def test_git_snapshot_get_many(tmp_path, remote_repo):
+    repo = create_git_config_repo(tmp_path / "repo", remote_url=remote_repo)
+    values = {f"key {i}": b"value %d" % i for i in range(2000)}
+    repo.set_many(values)
+    repo.commit()
+
+    snapshot = repo.base
+    keys = [*values, "missing", "other missing"]
+    # Enough requests to span several pipelined chunks
+    expected = {**values, "missing": None, "other missing": None}
+    assert snapshot.get_many(keys) == expected
+    assert snapshot.get("key 7") == b"value 7"
+
+
+def test_git_snapshot_read_survives_dead_process(tmp_path, remote_repo):
+    repo = create_git_config_repo(tmp_path / "repo", remote_url=remote_repo)
+    repo.set("foo", b"bar")
+    repo.set("baz", b"qux")
+    repo.commit()
+    assert repo.base.get("foo") == b"bar"
+
+    # Kill the shared cat-file process behind the session's back
+    process = repo._session._batch.process
+    process.kill()
+    process.wait()
+
+    assert repo.base.get("baz") == b"qux"
+    assert repo.base.get("missing") is None
+    # The next read starts a new process
+    repo.reload()
+    assert repo.base.get("foo") == b"bar"
+    assert repo._session._batch is not None
+    repo.close()
+    assert repo._session._batch is None
+
+
+def test_git_reload_keeps_unchanged_snapshot(tmp_path, remote_repo):
+    repo_a = create_git_config_repo(tmp_path / "repo_a", remote_url=remote_repo)
+    repo_b = create_git_config_repo(
+        tmp_path / "repo_b", remote_url=remote_repo, fetch_interval=3600
+    )
+    repo_a.set("foo", b"bar")
+    repo_a.commit()
+
+    # The first reload fetches, later ones within the interval don't
+    repo_b.reload()
+    snapshot = repo_b.base
+    assert snapshot.get("foo") == b"bar"
+
+    repo_a.set("foo", b"baz")
+    repo_a.commit()
+    assert repo_b.reload() is False
+    # Same head, so the snapshot and its cached values are kept
+    assert repo_b.base is snapshot
+    assert repo_b.get("foo") == b"bar"
+
+    repo_b.fetch_interval = 0
+    assert repo_b.reload() is True
+    assert repo_b.base is not snapshot
+    assert repo_b.get("foo") == b"baz"
+
+
+def test_git_list_branches(tmp_path, remote_repo):
+    repo = create_git_config_repo(tmp_path / "repo", remote_url=remote_repo)
+    # The bare clone starts out with packed refs only
+    assert repo.list_branches() == ["master"]
+
+    repo.create_branch("feature/x")
+    repo.create_branch("dev")
+    assert repo.list_branches() == ["dev", "feature/x", "master"]
+
+    # Loose refs written behind the repo's back are picked up, nested ones too
+    _git(repo.work_path, "branch", "other")
+    assert repo.list_branches() == ["dev", "feature/x", "master", "other"]
+    _git(repo.work_path, "branch", "feature/y")
+    assert repo.list_branches() == ["dev", "feature/x", "feature/y", "master", "other"]
+    # And so is packing them
+    _git(repo.work_path, "pack-refs", "--all")
+    _git(repo.work_path, "branch", "-D", "other")
+    assert repo.list_branches() == ["dev", "feature/x", "feature/y", "master"]
+    branches = _git(repo.work_path, "branch", "--format=%(refname:short)")
+    assert repo.list_branches() == branches.splitlines()
+
+
+def test_git_list_branches_reftable(tmp_path, remote_repo):
+    try:
+        _git(tmp_path, "init", "--bare", "--ref-format=reftable", "probe")
+    except subprocess.CalledProcessError:
+        pytest.skip("git without reftable support")
+    work = tmp_path / "repo"
+    _git(tmp_path, "clone", "--bare", "--ref-format=reftable", remote_repo, "repo")
+    repo = create_git_config_repo(work, remote_url=remote_repo)
+    repo.create_branch("feature/x")
+    assert repo.list_branches() == ["feature/x", "master"]
+
+
+def test_git_snapshot_get_into(tmp_path, remote_repo):
+    repo = create_git_config_repo(tmp_path / "repo", remote_url=remote_repo)
+    value = bytes(range(256)) * 1000
+    repo.set_many({"big": value, "small": b"small"})
+    repo.commit()
+
+    snapshot = repo.base
+    buf = bytearray(len(value) + 10)
+    with pytest.raises(ValueError):
+        snapshot.get_into("big", bytearray(10))
+    # Read straight from git, without keeping a copy in the cache
+    assert snapshot.get_into("big", buf) == len(value)
+    assert buf[: len(value)] == value
+    assert "big" not in snapshot._cache
+    assert snapshot.get_into("missing", buf) is None
+    assert snapshot.get("small") == b"small"
+
+
+def test_git_background_push(tmp_path, remote_repo):
+    repo = create_git_config_repo(
+        tmp_path / "repo", remote_url=remote_repo, background_push=True
+    )
+    repo.set("foo", b"bar")
+    repo.commit()
+    repo.set("foo", b"baz")
+    repo.commit()
+    # The local clone has the commits right away
+    assert repo.get("foo") == b"baz"
+
+    repo.flush()
+    assert _git(remote_repo, "show", "master:foo") == "baz"
+
+    # Failed pushes surface on flush, the commit stays local
+    hook = Path(remote_repo) / "hooks" / "pre-receive"
+    hook.write_text("#!/bin/sh\nexit 1\n")
+    hook.chmod(0o755)
+    repo.set("foo", b"local")
+    repo.commit()
+    with pytest.raises(subprocess.CalledProcessError):
+        repo.flush()
+    assert repo.get("foo") == b"local"
+    assert _git(remote_repo, "show", "master:foo") == "baz"
+    # The failure is kept on the repo, not raised from unrelated calls
+    assert list(repo.failed_pushes) == ["master"]
+    assert repo.reload() is False
+    assert not repo._pending_pushes
+
+    hook.unlink()
+    repo.retry_push()
+    assert repo.failed_pushes == {}
+    assert _git(remote_repo, "show", "master:foo") == "local"
+    repo.close()
+
+
+def test_git_reload_fetches_only_moved_branches(tmp_path, remote_repo):
+    repo_a = create_git_config_repo(tmp_path / "repo_a", remote_url=remote_repo)
+    repo_b = create_git_config_repo(tmp_path / "repo_b", remote_url=remote_repo)
+    fetch_head = tmp_path / "repo_b" / "FETCH_HEAD"
+
+    # Nothing new on the remote, ls-remote says so and no fetch runs
+    assert repo_b.get("foo") is None
+    assert repo_b.reload() is False
+    assert not fetch_head.exists()
+
+    repo_a.set("foo", b"bar")
+    repo_a.commit()
+    assert repo_b.reload() is True
+    assert fetch_head.exists()
+    assert repo_b.get("foo") == b"bar"
+
+
+def test_git_keys_with_newlines(tmp_path, remote_repo):
+    repo = create_git_config_repo(tmp_path / "repo", remote_url=remote_repo)
+    repo.set_many({"x\ny": b"multi", "a": b"1", "b": b"2"})
+    repo.commit()
+
+    snapshot = repo.base
+    # Read in one batch with regular keys, the shared process stays in sync
+    assert snapshot.get_many(["a", "x\ny", "b"]) == {
+        "a": b"1",
+        "x\ny": b"multi",
+        "b": b"2",
+    }
+    fresh = create_git_config_repo(tmp_path / "repo", remote_url=remote_repo)
+    assert fresh.get("x\ny") == b"multi"
+    assert fresh.get("a") == b"1"
+    assert fresh.get("b") == b"2"
+    buf = bytearray(8)
+    assert fresh.base.get_into("x\ny", buf) == 5
+    assert bytes(buf[:5]) == b"multi"
+
+
+def test_git_converts_clone_with_working_tree(tmp_path, remote_repo):
+    # A work path as kept by earlier versions, with a key named like a file
+    # of the git directory
+    work = tmp_path / "repo"
+    subprocess.run(
+        ["git", "clone", "--quiet", remote_repo, str(work)],
+        check=True,
+        capture_output=True,
+    )
+    (work / "config").write_text("value")
+    _git(work, "add", "config")
+    identity = ["-c", "user.name=Test", "-c", "user.email=test@test"]
+    _git(work, *identity, "commit", "-m", "Add config")
+    _git(work, "push", "origin", "master")
+
+    (work / "config").write_text("uncommitted")
+    with pytest.raises(RuntimeError):
+        create_git_config_repo(work, remote_url=remote_repo)
+    _git(work, "checkout", "--", "config")
+    # Ignored files would be deleted just the same
+    (work / ".git" / "info" / "exclude").write_text("*.local\n")
+    (work / "notes.local").write_text("keep me")
+    with pytest.raises(RuntimeError):
+        create_git_config_repo(work, remote_url=remote_repo)
+    assert (work / "notes.local").read_text() == "keep me"
+    (work / "notes.local").unlink()
+    # Another process converting it at the same time
+    lock = tmp_path / ".repo.lock"
+    lock.touch()
+    with pytest.raises(RuntimeError):
+        create_git_config_repo(work, remote_url=remote_repo)
+    lock.unlink()
+
+    repo = create_git_config_repo(work, remote_url=remote_repo)
+    assert _git(work, "rev-parse", "--is-bare-repository") == "true"
+    assert not (work / ".git").exists()
+    assert not lock.exists()
+    assert repo.get("config") == b"value"
+    repo.set("other", b"x")
+    repo.commit()
+    assert _git(remote_repo, "show", "master:other") == "x"
+
+
+def test_git_processes_see_environment_changes(tmp_path, remote_repo, monkeypatch):
+    repo = create_git_config_repo(tmp_path / "repo", remote_url=remote_repo)
+    monkeypatch.setenv("GIT_COMMITTER_NAME", "Changed Later")
+    repo.set("foo", b"bar")
+    repo.commit()
+    assert _git(repo.work_path, "log", "-1", "--format=%cn") == "Changed Later"
+
+
+def test_git_reload_merges_diverged_branch(tmp_path, remote_repo):
+    repo_a = create_git_config_repo(tmp_path / "repo_a", remote_url=remote_repo)
+    repo_b = create_git_config_repo(tmp_path / "repo_b", remote_url=remote_repo)
+    assert repo_b.get("shared") is None
+    repo_a.set_many({"shared": b"a", "from_a": b"a"})
+    repo_a.commit()
+
+    # B commits on a stale head, its push is rejected as non-fast-forward
+    repo_b.set_many({"shared": b"b", "from_b": b"b"})
+    with pytest.raises(subprocess.CalledProcessError):
+        repo_b.commit()
+    # Committed locally all the same
+    assert repo_b.is_dirty() is False
+    assert list(repo_b.failed_pushes) == ["master"]
+
+    # The remote's changes are merged in, they win where both changed a key
+    assert repo_b.reload() is True
+    assert repo_b.base.get_many(["shared", "from_a", "from_b"]) == {
+        "shared": b"a",
+        "from_a": b"a",
+        "from_b": b"b",
+    }
+    assert repo_b.get("shared") == b"a"
+    # Pushes go through again, with B's earlier commit
+    repo_b.retry_push()
+    assert repo_b.failed_pushes == {}
+    assert _git(remote_repo, "show", "master:from_b") == "b"
+    repo_b.set("later", b"b")
+    repo_b.commit()
+    assert _git(remote_repo, "show", "master:later") == "b"
+    assert repo_a.reload() is True
+    assert repo_a.get("from_b") == b"b"
+
+
+def test_git_snapshot_diff(tmp_path, remote_repo):
+    repo = create_git_config_repo(tmp_path / "repo", remote_url=remote_repo)
+    repo.set_many({"same": b"1", "changed": b"1", "removed": b"1"})
+    repo.commit()
+    old = repo.base
+
+    repo.set_many({"changed": b"2", "removed": None, "added": b"1"})
+    repo.commit()
+
+    diff = repo.base.diff(old)
+    assert diff.added == {"added"}
+    assert diff.removed == {"removed"}
+    assert diff.changed == {"changed"}
+    assert not old.diff(old)
@@ -0,0 +1,93 @@
+import sys
+
+from config_plane.impl.memory import MemoryConfigSnapshot, create_memory_config_repo
+
+
+def test_memory_snapshot_interning():
+    repo = create_memory_config_repo({})
+    repo.set("foo", b"bar")
+    repo.commit()
+    first = repo.base
+
+    repo.set("foo", b"changed")
+    repo.set("baz", b"qux")
+    repo.commit()
+    assert repo.base is not first
+
+    # Reverting to earlier contents brings back the earlier snapshot
+    repo.set("foo", b"bar")
+    repo.set("baz", None)
+    repo.commit()
+    assert repo.base is first
+    assert repo.get("foo") == b"bar"
+    assert repo.get("baz") is None
+
+
+def test_memory_snapshot_digest_is_incremental():
+    repo = create_memory_config_repo({})
+    for i in range(20):
+        repo.set(f"key{i}", b"%d" % i)
+        repo.set(f"key{i - 1}", None)
+        repo.commit()
+
+    rebuilt = MemoryConfigSnapshot(dict(repo.base.data))
+    assert repo.base.digest == rebuilt.digest
+
+
+def test_memory_snapshot_diff():
+    repo = create_memory_config_repo({})
+    repo.set("same", b"1")
+    repo.set("changed", b"1")
+    repo.set("removed", b"1")
+    repo.commit()
+    old = repo.base
+
+    repo.set("changed", b"2")
+    repo.set("removed", None)
+    repo.set("added", b"1")
+    repo.commit()
+
+    diff = repo.base.diff(old)
+    assert diff.added == {"added"}
+    assert diff.removed == {"removed"}
+    assert diff.changed == {"changed"}
+    assert not old.diff(old)
+
+
+def test_memory_snapshot_chain_depth_is_logarithmic():
+    repo = create_memory_config_repo({})
+    for i in range(1000):
+        repo.set(f"key{i}", b"%d" % i)
+        if i % 10 == 0:
+            repo.set(f"key{i // 2}", None)
+        repo.commit()
+
+    data = repo.base.data
+    assert len(getattr(data, "maps", [data])) <= 11
+    assert repo.get("key999") == b"999"
+    assert repo.get("key0") is None
+    assert repo.get("key1") == b"1"
+
+
+def test_memory_stage_interns_keys():
+    repo = create_memory_config_repo({})
+    # Built at runtime, so not interned by the compiler
+    key = "".join(["app", "/", "name"])
+    repo.set(key, b"v1")
+    repo.commit()
+
+    (stored,) = repo.base.data
+    assert stored is sys.intern("app/name")
+
+
+def test_memory_reload_reports_changes():
+    data = {}
+    repo = create_memory_config_repo(data)
+    other = create_memory_config_repo(data)
+    assert repo.reload() is False
+
+    other.set("foo", b"bar")
+    other.commit()
+    assert repo.reload() is True
+    assert repo.get("foo") == b"bar"
+    assert repo.reload() is False
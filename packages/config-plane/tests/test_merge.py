@@ -1,10 +1,8 @@
-import pytest
 from pathlib import Path
-from tests.test_repo_common import RepoProvider, PROVIDERS, PROVIDER_IDS
+from tests.test_repo_common import RepoProvider
 
 
-@pytest.mark.parametrize("provider_cls", PROVIDERS, ids=PROVIDER_IDS)
-def test_merge_simple(tmp_path: Path, provider_cls: type[RepoProvider]):
+def test_merge_simple(tmp_path: Path, repo_provider: RepoProvider):
     """
     Test simple merge scenario:
     1. Base: key1=v1
@@ -12,7 +10,6 @@ def test_merge_simple(tmp_path: Path, provider_cls: type[RepoProvider]):
     3. Branch Prod (from Base): key3=other
     4. Merge Dev into Prod -> Prod has key1=v2, key2=new, key3=other
     """
-    repo_provider = provider_cls()
     repo = repo_provider.create(tmp_path)
 
     try:
@@ -50,8 +47,7 @@ def test_merge_simple(tmp_path: Path, provider_cls: type[RepoProvider]):
         repo_provider.cleanup(repo)
 
 
-@pytest.mark.parametrize("provider_cls", PROVIDERS, ids=PROVIDER_IDS)
-def test_merge_conflict_override(tmp_path: Path, provider_cls: type[RepoProvider]):
+def test_merge_conflict_override(tmp_path: Path, repo_provider: RepoProvider):
     """
     Test conflict/override logic:
     1. Base: key1=v1
@@ -59,7 +55,6 @@ def test_merge_conflict_override(tmp_path: Path, provider_cls: type[RepoProvider
     3. Prod: key1=v3
     4. Merge Dev into Prod -> Prod should have key1=v2 (Source Wins per our logic)
     """
-    repo_provider = provider_cls()
     repo = repo_provider.create(tmp_path)
 
     try:
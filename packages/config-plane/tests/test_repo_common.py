@@ -1,17 +1,17 @@
 from pathlib import Path
 from typing import Callable
-import subprocess
+import shutil
 
 
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import Engine, create_engine
 from sqlalchemy.orm import sessionmaker
 
 from config_plane.base import ConfigRepo
 from config_plane.impl.memory import create_memory_config_repo, MemoryRepoData
 from config_plane.impl.git import create_git_config_repo
 
-from config_plane.impl.sql import create_sql_config_repo, Base
+from config_plane.impl.sql import create_sql_config_repo, configure_sqlite
 
 # Factory function signature: (tmp_path: Path) -> ConfigRepo
 RepoFactory = Callable[[Path], ConfigRepo]
@@ -26,12 +26,18 @@ RepoFactory = Callable[[Path], ConfigRepo]
 
 
 class RepoProvider:
+    # Session fixtures the provider is built from, passed to __init__
+    templates: tuple[str, ...] = ()
+
     def create(self, path: Path) -> ConfigRepo:
         raise NotImplementedError()
 
     def cleanup(self, repo: ConfigRepo) -> None:
         pass
 
+    def close(self) -> None:
+        """Release what the provider keeps for its repos, after the test."""
+
 
 class MemoryRepoProvider(RepoProvider):
     def __init__(self):
@@ -43,49 +49,15 @@ class MemoryRepoProvider(RepoProvider):
 
 
 class GitRepoProvider(RepoProvider):
+    templates = ("git_origin_template",)
+
+    def __init__(self, origin_template: Path):
+        self.origin_template = origin_template
+
     def create(self, path: Path) -> ConfigRepo:
         origin_path = path / "origin"
         if not origin_path.exists():
-            origin_path.mkdir()
-            # Init bare repo
-            subprocess.run(
-                ["git", "init", "--bare", "--initial-branch=master"],
-                cwd=origin_path,
-                check=True,
-                capture_output=True,
-            )
-            # To have 'master' branch available for cloning, we need a commit.
-            # We can clone it, commit, push.
-            init_cwd = path / "init_temp"
-            init_cwd.mkdir()
-            subprocess.run(
-                ["git", "clone", str(origin_path), "."],
-                cwd=init_cwd,
-                check=True,
-                capture_output=True,
-            )
-            # Config user
-            subprocess.run(
-                ["git", "config", "user.name", "Test"], cwd=init_cwd, check=True
-            )
-            subprocess.run(
-                ["git", "config", "user.email", "test@test"], cwd=init_cwd, check=True
-            )
-
-            # Commit
-            subprocess.run(
-                ["git", "commit", "--allow-empty", "-m", "Init"],
-                cwd=init_cwd,
-                check=True,
-            )
-            subprocess.run(
-                ["git", "push", "origin", "master"], cwd=init_cwd, check=True
-            )
-
-            # Cleanup
-            import shutil
-
-            shutil.rmtree(init_cwd)
+            shutil.copytree(self.origin_template, origin_path)
 
         # We need a unique path for each repo instance if we want them to cooperate or be distinct
         # But this provider mainly tests single repo lifecycle or persistence on same path.
@@ -103,30 +75,37 @@ class GitRepoProvider(RepoProvider):
 
 
 class SqlRepoProvider(RepoProvider):
-    def __init__(self):
-        self.engine = None
+    templates = ("sql_schema_template",)
+
+    def __init__(self, schema_template: Path):
+        self.schema_template = schema_template
+        # One engine, and so one connection pool, per database until the
+        # provider is closed. A restart is simulated by a new repo with its
+        # own session, the engine setup isn't paid again on every create().
+        self.engines: dict[str, Engine] = {}
 
     def create(self, path: Path) -> ConfigRepo:
         db_path = path / "config.db"
         db_url = f"sqlite:///{db_path}"
 
-        # We need to recreate engine/sessionmaker to simulate fresh start if called multiple times?
-        # Or just creating a new session is enough?
-        # For persistence check, we want to simulate application restart.
-
-        if self.engine:
-            self.engine.dispose()
-
-        self.engine = create_engine(db_url)
-        Base.metadata.create_all(self.engine)
-        Session = sessionmaker(bind=self.engine)
+        engine = self.engines.get(db_url)
+        if engine is None:
+            if not db_path.exists():
+                shutil.copyfile(self.schema_template, db_path)
+            engine = create_engine(db_url)
+            configure_sqlite(engine)
+            self.engines[db_url] = engine
+        Session = sessionmaker(bind=engine)
         return create_sql_config_repo(Session)
 
     def cleanup(self, repo: ConfigRepo) -> None:
-        if hasattr(repo, "session"):
-            repo.session.close()  # type: ignore
-        if self.engine:
-            self.engine.dispose()
+        if hasattr(repo, "close"):
+            repo.close()  # type: ignore
+
+    def close(self) -> None:
+        for engine in self.engines.values():
+            engine.dispose()
+        self.engines.clear()
 
 
 PROVIDERS = [
@@ -137,9 +116,7 @@ PROVIDERS = [
 PROVIDER_IDS = ["memory", "git", "sql"]
 
 
-@pytest.mark.parametrize("provider_cls", PROVIDERS, ids=PROVIDER_IDS)
-def test_repo_lifecycle(tmp_path: Path, provider_cls: type[RepoProvider]):
-    repo_provider = provider_cls()
+def test_repo_lifecycle(tmp_path: Path, repo_provider: RepoProvider):
     repo = repo_provider.create(tmp_path)
     try:
         # Test 1: Set initial value and check dirty
@@ -168,25 +145,96 @@ def test_repo_lifecycle(tmp_path: Path, provider_cls: type[RepoProvider]):
         repo_provider.cleanup(repo)
 
 
-@pytest.mark.parametrize("provider_cls", PROVIDERS, ids=PROVIDER_IDS)
-def test_repo_persistence(tmp_path: Path, provider_cls: type[RepoProvider]):
-    repo_provider = provider_cls()
-    # Setup initial state
+def test_repo_delete(tmp_path: Path, repo_provider: RepoProvider):
+    repo = repo_provider.create(tmp_path)
+    try:
+        repo.set("app", b"v1")
+        repo.set("db", b"v1")
+        repo.commit()
+
+        # Deleting a committed key hides it from the stage
+        repo.set("app", None)
+        assert repo.is_dirty() is True, "Repo should be dirty after delete"
+        assert repo.get("app") is None, "Deleted key should not be visible"
+
+        repo.commit()
+        assert repo.get("app") is None, "Deleted key should stay deleted"
+        assert repo.get("db") == b"v1", "Other keys should be untouched"
+    finally:
+        repo_provider.cleanup(repo)
+
+
+def test_repo_persistence(tmp_path: Path, repo_provider: RepoProvider):
+    # Setup initial state, a failure here fails the test
+    repo1 = repo_provider.create(tmp_path)
     try:
-        repo1 = repo_provider.create(tmp_path)
         repo1.set("db", b'{"host": "localhost"}')
         repo1.commit()
+    finally:
         repo_provider.cleanup(repo1)
-    except Exception:
-        pass
 
-    # Basic cleanup robustness improvement
-    repo2 = None
+    # Re-open repo
+    repo2 = repo_provider.create(tmp_path)
     try:
-        # Re-open repo
-        repo2 = repo_provider.create(tmp_path)
         val = repo2.get("db")
         assert val == b'{"host": "localhost"}', "Data should persist across instances"
     finally:
-        if repo2:
-            repo_provider.cleanup(repo2)
+        repo_provider.cleanup(repo2)
+
+
+def test_repo_set_many(tmp_path: Path, repo_provider: RepoProvider):
+    repo = repo_provider.create(tmp_path)
+    try:
+        repo.set_many({"app": b"v1", "db": b"v1", "cache": b"v2"})
+        assert repo.is_dirty() is True, "Repo should be dirty after set_many"
+        repo.commit()
+
+        repo.set_many({"app": b"v2", "db": None})
+        assert repo.get("app") == b"v2", "Updated key should be visible"
+        assert repo.get("db") is None, "Deleted key should not be visible"
+
+        repo.commit()
+        assert repo.get("app") == b"v2", "Updated key should be committed"
+        assert repo.get("db") is None, "Deleted key should stay deleted"
+        assert repo.get("cache") == b"v2", "Other keys should be untouched"
+    finally:
+        repo_provider.cleanup(repo)
+
+
+def test_repo_get_many(tmp_path: Path, repo_provider: RepoProvider):
+    repo = repo_provider.create(tmp_path)
+    try:
+        repo.set_many({"app": b"v1", "db": b"v1", "cache": b"v1"})
+        repo.commit()
+        repo.set_many({"app": b"v2", "db": None, "new": b"v1"})
+
+        keys = ["app", "db", "cache", "new", "missing"]
+        expected = {"app": b"v2", "db": None, "cache": b"v1", "new": b"v1"}
+        assert repo.get_many(keys) == {**expected, "missing": None}
+
+        repo.commit()
+        assert repo.get_many(keys) == {**expected, "missing": None}
+    finally:
+        repo_provider.cleanup(repo)
+
+
+def test_repo_get_into(tmp_path: Path, repo_provider: RepoProvider):
+    repo = repo_provider.create(tmp_path)
+    try:
+        repo.set_many({"app": b"committed", "db": b"v1"})
+        repo.commit()
+        repo.set("db", b"staged")
+
+        buf = bytearray(16)
+        assert repo.get_into("app", buf) == 9
+        assert bytes(buf[:9]) == b"committed"
+        assert repo.get_into("db", memoryview(buf)) == 6
+        assert bytes(buf[:6]) == b"staged"
+        assert repo.get_into("missing", buf) is None
+
+        with pytest.raises(ValueError):
+            repo.get_into("app", bytearray(4))
+        # A failed read leaves later reads intact
+        assert repo.get_into("app", buf) == 9
+    finally:
+        repo_provider.cleanup(repo)
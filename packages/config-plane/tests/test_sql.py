@@ -0,0 +1,463 @@
+import pytest
+from sqlalchemy import create_engine, delete, event, func, select, text
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import sessionmaker
+
+from config_plane.impl.sql import (
+    _MAX_CHAIN_DEPTH,
+    _blob_sha,
+    SCHEMA_VERSION,
+    Base,
+    BlobModel,
+    SchemaVersionModel,
+    SnapshotItemModel,
+    configure_sqlite,
+    create_sql_config_repo,
+    migrate_schema,
+)
+
+
+@pytest.fixture
+def session_maker():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def record_queries(engine) -> list[str]:
+    statements: list[str] = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    return statements
+
+
+def test_sql_committed_snapshot_cache(session_maker):
+    repo = create_sql_config_repo(session_maker)
+    repo.set("foo", b"bar")
+    repo.commit()
+
+    snapshot = repo.parent_snapshot
+    assert snapshot is not None
+    assert snapshot.get("foo") == b"bar"
+
+    statements = record_queries(session_maker.kw["bind"])
+    assert snapshot.get("foo") == b"bar"
+    assert snapshot.get("missing") is None
+    assert statements == []
+
+    # Another writer moves the branch, reload switches to the new snapshot
+    other = create_sql_config_repo(session_maker)
+    other.set("foo", b"baz")
+    other.commit()
+    assert repo.reload() is True
+    assert repo.get("foo") == b"baz"
+    assert repo.reload() is False
+
+
+def test_sql_blobs_are_deduplicated(session_maker):
+    repo = create_sql_config_repo(session_maker)
+    repo.set("a", b"same")
+    repo.set("b", b"same")
+    repo.commit()
+    repo.set("c", b"same")
+    repo.set("a", b"other")
+    repo.commit()
+
+    assert repo.get("b") == b"same"
+    assert repo.get("a") == b"other"
+    with session_maker() as session:
+        count = session.execute(select(func.count()).select_from(BlobModel))
+        assert count.scalar_one() == 2
+
+
+def test_sql_snapshot_load_all(session_maker):
+    repo = create_sql_config_repo(session_maker)
+    repo.set_many({"a": b"1", "b": b"2", "c": b"3"})
+    repo.commit()
+    repo.set("b", None)
+    repo.commit()
+
+    snapshot = repo.parent_snapshot
+    assert snapshot is not None
+    assert snapshot.load_all() == {"a": b"1", "c": b"3"}
+
+    # Loading everything warms the snapshot cache
+    statements = record_queries(session_maker.kw["bind"])
+    assert snapshot.get("a") == b"1"
+    assert snapshot.get("b") is None
+    assert statements == []
+
+
+def test_sql_get_many_large(session_maker):
+    repo = create_sql_config_repo(session_maker)
+    values = {f"key{i}": b"%d" % i for i in range(1200)}
+    repo.set_many(values)
+    # Read through the stage before and after the keys are committed
+    assert repo.get_many(values) == values
+    repo.commit()
+    assert repo.get_many([*values, "missing"]) == {**values, "missing": None}
+
+
+def test_sql_repo_reuses_session(session_maker):
+    repo = create_sql_config_repo(session_maker)
+    repo.set("foo", b"bar")
+    assert repo.get("foo") == b"bar"
+
+    checkouts = []
+    event.listen(
+        session_maker.kw["bind"], "checkout", lambda *args: checkouts.append(args)
+    )
+    # Reads run on the repo's session and connection, without a new
+    # transaction each
+    for _ in range(3):
+        assert repo.get("foo") == b"bar"
+        assert repo.get_many(["foo", "missing"]) == {"foo": b"bar", "missing": None}
+        assert repo.is_dirty()
+    assert checkouts == []
+
+    # reload() ends the read transaction, so do writes
+    assert repo.session.in_transaction()
+    repo.reload()
+    assert repo.get("foo") == b"bar"
+    repo.set("foo", b"baz")
+    assert not repo.session.in_transaction()
+
+    repo.commit()
+    assert repo.get("foo") == b"baz"
+    repo.close()
+
+
+def test_sql_set_many_batches_statements(session_maker):
+    repo = create_sql_config_repo(session_maker)
+    values = {f"key{i}": b"%d" % i for i in range(2500)}
+
+    statements = record_queries(session_maker.kw["bind"])
+    repo.set_many(values)
+    # A handful of bounded IN lookups and batched inserts, not one per key
+    assert len(statements) < 20
+
+    repo.commit()
+    assert repo.get_many(values) == values
+
+
+def test_sql_blob_cache_shared_across_snapshots(session_maker):
+    repo = create_sql_config_repo(session_maker)
+    repo.set_many({"a": b"1", "b": b"2"})
+    repo.commit()
+    assert repo.get_many(["a", "b"]) == {"a": b"1", "b": b"2"}
+
+    # The next snapshot only needs to load its key -> blob id mapping
+    repo.set("c", b"3")
+    repo.commit()
+    statements = record_queries(session_maker.kw["bind"])
+    assert repo.get_many(["a", "b"]) == {"a": b"1", "b": b"2"}
+    assert len(statements) == 2  # stage lookup and the snapshot's items
+
+
+def test_sql_blob_cache_is_bounded(session_maker):
+    repo = create_sql_config_repo(session_maker, cache_bytes=1024)
+    values = {f"key{i}": bytes([i]) * 100 for i in range(50)}
+    repo.set_many(values)
+    repo.commit()
+
+    assert repo.get_many(values) == values
+    assert repo.parent_snapshot._blobs.size <= 1024
+    assert repo.get("key7") == values["key7"]
+
+
+def test_sql_commit_writes_only_changes(session_maker):
+    repo = create_sql_config_repo(session_maker)
+    repo.set_many({f"key{i}": b"value %d" % i for i in range(100)})
+    repo.commit()
+
+    def item_count() -> int:
+        with session_maker() as session:
+            stmt = select(func.count()).select_from(SnapshotItemModel)
+            return session.execute(stmt).scalar_one()
+
+    for i in range(_MAX_CHAIN_DEPTH + 4):
+        before = item_count()
+        repo.set("key0", b"changed %d" % i)
+        repo.set(f"key{i + 1}", None)
+        repo.commit()
+        if i + 1 < _MAX_CHAIN_DEPTH:
+            assert item_count() - before == 2
+
+        fresh = create_sql_config_repo(session_maker)
+        assert fresh.get("key0") == b"changed %d" % i
+        assert fresh.get(f"key{i + 1}") is None
+        assert fresh.get("key99") == b"value 99"
+        assert len(fresh.parent_snapshot.load_all()) == 99 - i
+
+
+def test_sql_writes_without_upsert_or_returning(session_maker, monkeypatch):
+    # The paths taken on MySQL and other dialects
+    dialect = session_maker.kw["bind"].dialect
+    monkeypatch.setattr(dialect, "name", "other")
+    monkeypatch.setattr(dialect, "insert_executemany_returning", False)
+
+    repo = create_sql_config_repo(session_maker)
+    repo.set_many({"a": b"1", "b": b"2"})
+    repo.set_many({"a": b"3", "b": None, "c": b"2"})
+    assert repo.get_many(["a", "b", "c"]) == {"a": b"3", "b": None, "c": b"2"}
+    repo.commit()
+    assert repo.get_many(["a", "b", "c"]) == {"a": b"3", "b": None, "c": b"2"}
+
+
+def test_sql_configure_sqlite(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'config.db'}")
+    configure_sqlite(engine)
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+    engine.dispose()
+
+
+def test_sql_get_is_a_single_query(session_maker):
+    repo = create_sql_config_repo(session_maker)
+    repo.set("committed", b"1")
+    repo.commit()
+    repo.set("staged", b"2")
+    # Loads the committed snapshot's items and blob once
+    assert repo.get("committed") == b"1"
+
+    statements = record_queries(session_maker.kw["bind"])
+    for key, value in [("committed", b"1"), ("staged", b"2"), ("missing", None)]:
+        statements.clear()
+        assert repo.get(key) == value
+        assert len(statements) == 1
+
+    with session_maker() as session:
+        item = session.execute(select(SnapshotItemModel)).scalars().first()
+        with pytest.raises(InvalidRequestError):
+            item.blob
+
+
+def test_sql_blobs_are_compressed(session_maker):
+    text = b'{"name": "service", "debug": false}\n' * 100
+    noise = bytes(range(256))
+    repo = create_sql_config_repo(session_maker)
+    repo.set_many({"text": text, "noise": noise, "small": b"x"})
+    assert repo.get("text") == text
+    repo.commit()
+    assert repo.get_many(["text", "noise", "small"]) == {
+        "text": text,
+        "noise": noise,
+        "small": b"x",
+    }
+
+    with session_maker() as session:
+        stored = session.execute(select(func.max(func.length(BlobModel.content))))
+        assert stored.scalar_one() < len(text) // 4
+    fresh = create_sql_config_repo(session_maker)
+    assert fresh.parent_snapshot.load_all()["text"] == text
+
+
+def test_sql_merge_per_key(session_maker):
+    repo = create_sql_config_repo(session_maker)
+    repo.set_many({"shared": b"v1", "ours": b"v1", "theirs": b"v1"})
+    repo.commit()
+
+    repo.create_branch("dev")
+    repo.switch_branch("dev")
+    repo.set_many({"shared": b"dev", "theirs": None, "added": b"dev"})
+    repo.commit()
+
+    repo.switch_branch("master")
+    repo.set_many({"shared": b"master", "ours": b"master"})
+    repo.commit()
+
+    # Only blob ids are copied, no blob is read or written
+    statements = record_queries(session_maker.kw["bind"])
+    repo.merge("dev")
+    assert not any("INSERT INTO blobs" in s for s in statements)
+    repo.commit()
+    assert repo.get_many(["shared", "ours", "theirs", "added"]) == {
+        "shared": b"dev",
+        "ours": b"master",
+        "theirs": None,
+        "added": b"dev",
+    }
+
+    # The merge is recorded, merging again changes nothing
+    repo.set("ours", b"later")
+    repo.commit()
+    repo.merge("dev")
+    assert repo.is_dirty() is False
+    assert repo.get("ours") == b"later"
+
+
+def test_sql_commit_after_reload_keeps_other_commits(session_maker):
+    repo_a = create_sql_config_repo(session_maker)
+    repo_a.set("a", b"1")
+    repo_a.commit()
+
+    repo_b = create_sql_config_repo(session_maker)
+    repo_b.set("k", b"from b")
+    repo_b.commit()
+
+    # The stage is rebased on b's commit, a's next commit builds on it
+    assert repo_a.reload() is True
+    repo_a.set("a", b"2")
+    repo_a.commit()
+
+    fresh = create_sql_config_repo(session_maker)
+    assert fresh.get_many(["a", "k"]) == {"a": b"2", "k": b"from b"}
+
+
+def test_sql_merge_base_is_lowest_common_ancestor(session_maker):
+    base = create_sql_config_repo(session_maker)
+    base.set("db_url", b"v0")
+    base.commit()
+    base.create_branch("dev")
+
+    # prod's stage opens before dev's commit, so prod's merge commit gets a
+    # lower id than its merge parent
+    prod = create_sql_config_repo(session_maker)
+    dev = create_sql_config_repo(session_maker, branch="dev")
+    dev.set("feature", b"on")
+    dev.commit()
+    prod.set("db_url", b"v1")
+    prod.merge("dev")
+    prod.commit()
+
+    dev.merge("master")
+    dev.commit()
+    prod.set("db_url", b"v2")
+    prod.commit()
+
+    # dev has nothing new for prod, the newer db_url stays
+    prod.merge("dev")
+    prod.commit()
+    assert prod.get_many(["db_url", "feature"]) == {
+        "db_url": b"v2",
+        "feature": b"on",
+    }
+
+
+@pytest.mark.parametrize("dialect_name", ["sqlite", "other"])
+def test_sql_blob_inserted_concurrently(session_maker, monkeypatch, dialect_name):
+    engine = session_maker.kw["bind"]
+    monkeypatch.setattr(engine.dialect, "name", dialect_name)
+    value = b"raced"
+    raced = []
+
+    # Another writer stores the same blob between the lookup and the insert
+    @event.listens_for(engine, "before_cursor_execute")
+    def _race(conn, cursor, statement, *args):
+        if statement.startswith("INSERT INTO blobs") and not raced:
+            raced.append(True)
+            cursor.execute(
+                "INSERT INTO blobs (content, content_sha, codec) VALUES (?, ?, 0)",
+                (value, _blob_sha(value)),
+            )
+
+    repo = create_sql_config_repo(session_maker)
+    repo.set("a", value)
+    repo.commit()
+    assert raced
+    assert create_sql_config_repo(session_maker).get("a") == value
+    with session_maker() as session:
+        count = session.execute(select(func.count()).select_from(BlobModel))
+        assert count.scalar_one() == 1
+
+
+def test_sql_schema_version_is_checked(session_maker):
+    repo = create_sql_config_repo(session_maker)
+    repo.set("a", b"1")
+    repo.commit()
+    with session_maker() as session:
+        stored = session.execute(select(SchemaVersionModel.version)).scalars()
+        assert stored.all() == [SCHEMA_VERSION]
+
+        # A database with data but no version predates the current tables
+        session.execute(delete(SchemaVersionModel))
+        session.commit()
+    with pytest.raises(RuntimeError, match="schema version 1"):
+        create_sql_config_repo(session_maker)
+
+    SchemaVersionModel.__table__.drop(session_maker.kw["bind"])
+    with pytest.raises(RuntimeError, match="no schema_version table"):
+        create_sql_config_repo(session_maker)
+
+
+# Tables as created by the first release, before versions were recorded
+_V1_TABLES = [
+    "CREATE TABLE blobs (id INTEGER NOT NULL, content BLOB NOT NULL, "
+    "PRIMARY KEY (id))",
+    "CREATE TABLE snapshots (id INTEGER NOT NULL, parent_id INTEGER, "
+    "committed BOOLEAN NOT NULL, PRIMARY KEY (id), "
+    "FOREIGN KEY(parent_id) REFERENCES snapshots (id))",
+    "CREATE TABLE snapshot_items (snapshot_id INTEGER NOT NULL, "
+    "key VARCHAR NOT NULL, blob_id INTEGER, PRIMARY KEY (snapshot_id, key), "
+    "FOREIGN KEY(snapshot_id) REFERENCES snapshots (id), "
+    "FOREIGN KEY(blob_id) REFERENCES blobs (id))",
+    "CREATE TABLE branches (name VARCHAR NOT NULL, snapshot_id INTEGER NOT NULL, "
+    "PRIMARY KEY (name), FOREIGN KEY(snapshot_id) REFERENCES snapshots (id))",
+]
+
+
+def test_sql_migrate_v1_database():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        for ddl in _V1_TABLES:
+            conn.execute(text(ddl))
+        # Committed snapshots were full copies, blobs weren't shared
+        conn.execute(
+            text("INSERT INTO blobs VALUES (1, x'78'), (2, x'78'), (3, x'79')")
+        )
+        conn.execute(
+            text("INSERT INTO snapshots VALUES (1, NULL, 1), (2, 1, 1), (3, 2, 0)")
+        )
+        conn.execute(
+            text(
+                "INSERT INTO snapshot_items VALUES (1, 'a', 1), (1, 'b', 3), "
+                "(2, 'a', 2), (2, 'b', NULL), (3, 'c', 3)"
+            )
+        )
+        conn.execute(text("INSERT INTO branches VALUES ('master', 2)"))
+    session_maker = sessionmaker(bind=engine)
+    with pytest.raises(RuntimeError, match="migrate_schema"):
+        create_sql_config_repo(session_maker)
+
+    migrate_schema(engine)
+    # Already up to date
+    migrate_schema(engine)
+
+    repo = create_sql_config_repo(session_maker, stage_snapshot_id=3)
+    assert repo.get_many(["a", "b", "c"]) == {"a": b"x", "b": None, "c": b"y"}
+    repo.set("d", b"x")
+    repo.set("e", b"z")
+    repo.commit()
+    assert repo.get_many(["a", "c", "d", "e"]) == {
+        "a": b"x",
+        "c": b"y",
+        "d": b"x",
+        "e": b"z",
+    }
+    with session_maker() as session:
+        contents = session.execute(select(BlobModel.content)).scalars().all()
+        assert sorted(contents) == [b"x", b"y", b"z"]
+        stored = session.execute(select(SchemaVersionModel.version)).scalars()
+        assert stored.all() == [SCHEMA_VERSION]
+    engine.dispose()
+
+
+def test_sql_snapshot_diff(session_maker):
+    repo = create_sql_config_repo(session_maker)
+    repo.set_many({"same": b"1", "changed": b"1", "removed": b"1"})
+    repo.commit()
+    old = repo.parent_snapshot
+
+    repo.set_many({"changed": b"2", "removed": None, "added": b"1"})
+    repo.commit()
+
+    diff = repo.parent_snapshot.diff(old)
+    assert diff.added == {"added"}
+    assert diff.removed == {"removed"}
+    assert diff.changed == {"changed"}
+    assert not old.diff(old)
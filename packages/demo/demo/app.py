@@ -1,13 +1,16 @@
+import functools
 import time
 import argparse
 import sys
+from pathlib import Path
+from typing import Any, Callable
 
-from sqlalchemy import create_engine
+from sqlalchemy import Engine, create_engine
 from sqlalchemy.orm import sessionmaker
 
 from config_plane.base import ConfigRepo
 from config_plane.impl.git import create_git_config_repo
-from config_plane.impl.sql import create_sql_config_repo, Base
+from config_plane.impl.sql import create_sql_config_repo, configure_sqlite, Base
 
 
 def debug_print(msg: str):
@@ -21,11 +24,67 @@ def get_feature_x_status(repo: ConfigRepo) -> str:
     return "Disabled"
 
 
+# Themes come from a small set, a bounded cache still keeps arbitrary
+# values from piling up
+@functools.lru_cache(maxsize=64)
+def _theme_name(val: bytes) -> str:
+    return val.decode("utf-8", "replace").capitalize()
+
+
 def get_theme(repo: ConfigRepo) -> str:
     val = repo.get("theme")
-    if val:
-        return val.decode("utf-8").capitalize()
-    return "Default"
+    if not val:
+        return "Default"
+    return _theme_name(val)
+
+
+def sqlite_data_version(engine: Engine) -> Callable[[], int] | None:
+    """
+    Return a function reading SQLite's data_version, None for other databases.
+
+    data_version changes whenever another connection commits to the database,
+    so polling it on one dedicated connection costs next to nothing. The
+    connection stays open for the life of the app.
+    """
+    if engine.dialect.name != "sqlite":
+        return None
+    connection = engine.raw_connection()
+
+    def read() -> int:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("PRAGMA data_version")
+            return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+
+    return read
+
+
+def git_ref_version(remote_url: str, branch: str) -> Callable[[], Any] | None:
+    """
+    Return a function telling whether `branch` may have moved on a remote
+    that is a local directory, None for other remotes.
+
+    A push rewrites the loose ref file (and gc rewrites packed-refs), so
+    their modification times change with every update. Reading them is two
+    stat calls instead of asking the remote through git.
+    """
+    origin = Path(remote_url)
+    if not (origin / "HEAD").exists():
+        return None
+    ref_paths = [origin / "refs" / "heads" / branch, origin / "packed-refs"]
+
+    def read() -> Any:
+        versions = []
+        for path in ref_paths:
+            try:
+                versions.append(path.stat().st_mtime_ns)
+            except FileNotFoundError:
+                versions.append(None)
+        return tuple(versions)
+
+    return read
 
 
 def main():
@@ -33,7 +92,19 @@ def main():
     parser.add_argument("--repo-uri", required=True, help="URI/Path to config repo")
     parser.add_argument("--branch", default="master", help="Config branch to use")
     parser.add_argument(
-        "--poll-interval", type=int, default=2, help="Poll interval in seconds"
+        "--min-poll",
+        # The single fixed interval of earlier versions
+        "--poll-interval",
+        type=float,
+        default=1.0,
+        help="Poll interval in seconds right after a change",
+    )
+    parser.add_argument(
+        "--max-poll",
+        type=float,
+        # The old fixed interval, an idle app doesn't notice changes any later
+        default=2.0,
+        help="Longest poll interval in seconds while nothing changes",
     )
     parser.add_argument("--name", default="App", help="App Instance Name")
     parser.add_argument(
@@ -46,20 +117,26 @@ def main():
     parser.add_argument("--remote-url", default=None, help="Remote Git Configuration")
 
     args = parser.parse_args()
+    # A longer --poll-interval alone keeps polling at that fixed interval
+    args.max_poll = max(args.max_poll, args.min_poll)
+    # Output is piped to the scenario, make each line show up right away
+    # without flushing by hand
+    sys.stdout.reconfigure(line_buffering=True)
 
     if args.backend == "sql":
         # For SQL backend, repo-uri is database URL
         # We assume SQL backend for this demo as per requirements
         # Initialize infrastructure
-        # Add timeout for concurrency
-        engine = create_engine(args.repo_uri, connect_args={"timeout": 1})
+        # Exactly two connections for the app's life: the repo's session and
+        # the data_version poll. Nothing is opened or closed per poll.
+        engine = create_engine(args.repo_uri, pool_size=2, max_overflow=0)
+        # WAL mode and a busy timeout for concurrency, ignored for other
+        # databases
+        configure_sqlite(engine)
         Base.metadata.create_all(engine)
 
-        # Enable WAL mode for better concurrency (handled by scenario or ignored if fails)
-        with engine.connect() as conn:
-            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
-
         SessionLocal = sessionmaker(bind=engine)
+        poll_version = sqlite_data_version(engine)
 
         # Initialize repo once
         debug_print(f"{args.name} starting on branch '{args.branch}' (SQL)...")
@@ -74,24 +151,34 @@ def main():
         repo = create_git_config_repo(
             args.repo_uri, remote_url=args.remote_url, branch=args.branch
         )
+        poll_version = git_ref_version(args.remote_url, args.branch)
 
+    # Poll quickly after a change and back off exponentially while the
+    # branch stays put, so an idle config costs few reloads
+    interval = args.min_poll
+    shown = None
+    last_version = None
     while True:
         try:
-            # Reload to get fresh state.
-            repo.reload()
-
-            feat = get_feature_x_status(repo)
-            theme = get_theme(repo)
-
-            print(f"[{args.name}] Feature X: {feat}, Theme: {theme}")
-            sys.stdout.flush()
-
-            # repo.session.close() # Keep session open for reuse
+            # Skip reload() entirely while nothing was committed to the
+            # database or pushed to the origin, reload() itself reports
+            # whether the branch moved
+            version = poll_version() if poll_version is not None else None
+            changed = (version is None or version != last_version) and repo.reload()
+            last_version = version
+            if changed or shown is None:
+                interval = args.min_poll
+                current = (get_feature_x_status(repo), get_theme(repo))
+                if current != shown:
+                    shown = current
+                    print(f"[{args.name}] Feature X: {current[0]}, Theme: {current[1]}")
+            else:
+                interval = min(args.max_poll, interval * 2)
 
         except Exception as e:
             debug_print(f"Error reading config: {e}")
 
-        time.sleep(args.poll_interval)
+        time.sleep(interval)
 
 
 if __name__ == "__main__":
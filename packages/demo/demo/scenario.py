@@ -3,25 +3,94 @@ import subprocess
 import sys
 import argparse
 import shutil
+import os
+import tempfile
+import queue
+import threading
 from pathlib import Path
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from loguru import logger
 
-from config_plane.impl.sql import create_sql_config_repo, Base
+from config_plane.impl.sql import create_sql_config_repo, configure_sqlite, Base
 from config_plane.impl.git import create_git_config_repo
 
-# Setup paths that are safe to use
-TMP_DIR = Path("tmp").absolute()
-DB_PATH = TMP_DIR / "demo.db"
-DB_URL = f"sqlite:///{DB_PATH}"
 
-GIT_REPO_PATH = TMP_DIR / "demo-config-repo"
+def _scratch_dir() -> Path:
+    """
+    Where the demo keeps its database and repos: RAM-backed /dev/shm when
+    the system has it, so the many small SQLite and git writes skip the
+    disk, ./tmp otherwise.
+    """
+    shm = Path("/dev/shm")
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        return shm / "config-plane-demo"
+    return Path("tmp").absolute()
+
+
+# Setup paths that are safe to use, every run gets a directory of its own
+# in there
+TMP_DIR = _scratch_dir()
+
+
+# Pause before each step so a person can follow along, set by --interactive
+INTERACTIVE = False
 
 
 def run_step(step_num: int, title: str):
     print(f"\n=== Step {step_num}: {title} ===")
-    time.sleep(1)
+    if INTERACTIVE:
+        time.sleep(1)
+
+
+def _quiet_run(args: list[str], cwd: Path, input: str | None = None) -> None:
+    """
+    Run a setup command without echoing its output, stderr is printed only
+    when it fails. `input` is fed to the command's stdin.
+    """
+    try:
+        subprocess.run(
+            args,
+            cwd=cwd,
+            check=True,
+            input=input,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+    except subprocess.CalledProcessError as e:
+        print(e.stderr, file=sys.stderr)
+        raise
+
+
+def _follow(app: subprocess.Popen) -> "queue.Queue[str]":
+    """
+    Echo an app's stdout as it arrives and queue each line for `_wait_for`.
+    """
+    lines: "queue.Queue[str]" = queue.Queue()
+
+    def pump():
+        for line in app.stdout:
+            sys.stdout.write(line)
+            lines.put(line)
+
+    threading.Thread(target=pump, daemon=True).start()
+    return lines
+
+
+def _wait_for(lines: "queue.Queue[str]", text: str, timeout: float = 30.0) -> None:
+    """
+    Block until an app prints a line containing `text`, at most `timeout`
+    seconds. The demo goes on with a warning if it never shows up.
+    """
+    deadline = time.monotonic() + timeout
+    while (remaining := deadline - time.monotonic()) > 0:
+        try:
+            if text in lines.get(timeout=remaining):
+                return
+        except queue.Empty:
+            break
+    logger.warning(f"No '{text}' from the app after {timeout:.0f}s")
 
 
 def main():
@@ -32,23 +101,39 @@ def main():
         default="sql",
         help="Backend type (default: sql)",
     )
+    parser.add_argument(
+        "--interactive",
+        action="store_true",
+        help="Pause a second before each step",
+    )
     args = parser.parse_args()
+    global INTERACTIVE
+    INTERACTIVE = args.interactive
 
-    # Ensure tmp dir exists
+    # A fresh directory per run, nothing left over from earlier runs to clean
+    # up first
     TMP_DIR.mkdir(parents=True, exist_ok=True)
-
-    # Cleanup previous runs
-    if DB_PATH.exists():
-        DB_PATH.unlink()
-    # Also cleanup WAL files to prevent IO errors if leftover
-    for p in TMP_DIR.glob("demo.db*"):
-        try:
-            p.unlink()
-        except OSError:
-            pass
-
-    if GIT_REPO_PATH.exists():
-        shutil.rmtree(GIT_REPO_PATH)
+    run_dir = Path(tempfile.mkdtemp(prefix="run-", dir=TMP_DIR))
+
+    # The apps run in sessions of their own, so Ctrl+C doesn't reach them.
+    # They are stopped, and the run's files removed, however the scenario
+    # ends. run_dir may be on /dev/shm, where leftovers would hold RAM.
+    apps: list[subprocess.Popen] = []
+    try:
+        run_scenario(args, run_dir, apps)
+    finally:
+        for app in apps:
+            app.terminate()
+        for app in apps:
+            app.wait()
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def run_scenario(
+    args: argparse.Namespace, run_dir: Path, apps: list[subprocess.Popen]
+) -> None:
+    """Run the demo steps in `run_dir`, adding the apps it starts to `apps`."""
+    db_url = f"sqlite:///{run_dir / 'demo.db'}"
 
     # Initialize Infrastructure & Define Repo Factory
     SessionLocal = None
@@ -58,19 +143,17 @@ def main():
     dev_repo_uri = ""
 
     if args.backend == "sql":
-        repo_uri = DB_URL
+        repo_uri = db_url
         prod_repo_uri = repo_uri
         dev_repo_uri = repo_uri
 
         # Initialize infrastructure
-        # Add timeout for concurrency
-        engine = create_engine(DB_URL, connect_args={"timeout": 1})
+        engine = create_engine(db_url)
+        # WAL mode and a busy timeout for concurrency, ignored for other
+        # databases
+        configure_sqlite(engine)
         Base.metadata.create_all(engine)
 
-        # Enable WAL mode for better concurrency
-        with engine.connect() as conn:
-            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
-
         SessionLocal = sessionmaker(bind=engine)
 
         def create_repo(uri, branch="prod"):
@@ -79,38 +162,30 @@ def main():
     else:
         # Git Backend Setup
         # Structure:
-        #   tmp/demo-repo-origin (Bare)
-        #   tmp/demo-repo-prod (Clone 1) -> ProdApp
-        #   tmp/demo-repo-dev (Clone 2) -> DevApp
-
-        origin_path = TMP_DIR / "demo-repo-origin"
-        prod_path = TMP_DIR / "demo-repo-prod"
-        dev_path = TMP_DIR / "demo-repo-dev"
+        #   run_dir/demo-repo-origin (Bare)
+        #   run_dir/demo-repo-prod (Clone 1) -> ProdApp
+        #   run_dir/demo-repo-dev (Clone 2) -> DevApp
 
-        # Cleanup
-        for p in [origin_path, prod_path, dev_path]:
-            if p.exists():
-                shutil.rmtree(p)
+        origin_path = run_dir / "demo-repo-origin"
+        prod_path = run_dir / "demo-repo-prod"
+        dev_path = run_dir / "demo-repo-dev"
 
         # 1. Init bare origin
         origin_path.mkdir()
-        subprocess.run(
-            ["git", "init", "--bare", "--initial-branch=master"],
-            cwd=origin_path,
-            check=True,
-        )
-        # Create a dummy clone to push initial commit so master exists
-        init_path = TMP_DIR / "init-temp"
-        if init_path.exists():
-            shutil.rmtree(init_path)
-        subprocess.run(["git", "clone", str(origin_path), str(init_path)], check=True)
-        (init_path / "README").write_text("Init")
-        subprocess.run(["git", "add", "."], cwd=init_path, check=True)
-        subprocess.run(
-            ["git", "commit", "-m", "Initial commit"], cwd=init_path, check=True
+        _quiet_run(["git", "init", "--bare", "--initial-branch=master"], origin_path)
+        # Write an empty initial commit straight into the origin so master
+        # exists. fast-import creates the commit and moves the ref in one
+        # git process, no clone or `git config`.
+        message = "Initial commit\n"
+        _quiet_run(
+            ["git", "fast-import", "--quiet"],
+            origin_path,
+            input=(
+                "commit refs/heads/master\n"
+                f"committer Demo <demo@localhost> {int(time.time())} +0000\n"
+                f"data {len(message)}\n{message}\n"
+            ),
         )
-        subprocess.run(["git", "push", "origin", "master"], cwd=init_path, check=True)
-        shutil.rmtree(init_path)
 
         prod_repo_uri = str(prod_path)
         dev_repo_uri = str(dev_path)
@@ -125,16 +200,14 @@ def main():
     run_step(1, "Initialize Repository")
     logger.info(f"Creating {args.backend.upper()} Repo (Prod) at {prod_repo_uri}")
 
-    # Create initial state in Prod Repo
-    # Start with master to ensure we have a valid HEAD before creating prod
-    repo = create_repo(prod_repo_uri, branch="master")
-
+    # One long-lived repo per role, reused by every step below
     # For Git, we need to make sure we are on 'prod'.
     if args.backend == "git":
+        # Start with master to ensure we have a valid HEAD before creating prod
+        repo = create_repo(prod_repo_uri, branch="master")
         # We are on master (empty). create_branch needs a valid commit if branching from specific point,
         # or we just commit to master first.
-        repo.set("feature_x_enabled", b"false")
-        repo.set("theme", b"light")
+        repo.set_many({"feature_x_enabled": b"false", "theme": b"light"})
         # In GitConfigRepo, commit() now pushes!
         # However, for the very first push of master?
         # Standard push origin master works.
@@ -144,17 +217,10 @@ def main():
         # But we want to create prod branch.
         repo.create_branch("prod", from_branch="master")
         repo.switch_branch("prod")
-        # Ensure we push the new branch?
-        # create_branch might not push.
-        # But commit() pushes current branch.
-        # If we just created it and made no changes, we might need manual push?
-        # Or better: make a change on prod and commit.
-        repo.set("feature_x_enabled", b"false")  # trigger dirty check if any?
-        # Actually set again to be sure or set something new.
-        # Currently dirty check compares to stage.
-        # If I switched branch, stage is reloaded.
-        # Let's just touch something.
-        repo.set("meta", b"init-prod")
+        # create_branch doesn't push, but commit() pushes the current branch.
+        # A value equal to the committed one is dropped on commit, so touch a
+        # new key as well to make the commit happen.
+        repo.set_many({"feature_x_enabled": b"false", "meta": b"init-prod"})
         repo.commit()
 
         # Also ensure master is pushed if it wasn't?
@@ -162,19 +228,19 @@ def main():
     else:
         # SQL: Directly on prod
         repo = create_repo(prod_repo_uri, branch="prod")
-        repo.set("feature_x_enabled", b"false")
-        repo.set("theme", b"light")
+        # Both keys are written in one transaction
+        repo.set_many({"feature_x_enabled": b"false", "theme": b"light"})
         repo.commit()
 
+    prod_repo = repo
     logger.info("Initialized 'prod' with Feature X: Disabled, Theme: Light")
 
     # 2. Start Production App
     run_step(2, "Start Production App")
     prod_app = subprocess.Popen(
         [
-            "uv",
-            "run",
-            "python",
+            # Same interpreter and environment as the scenario, no uv resolve
+            sys.executable,
             "-m",
             "demo.app",
             "--repo-uri",
@@ -185,43 +251,40 @@ def main():
             "prod",
             "--name",
             "ProdApp",
-            "--poll-interval",
-            "5",
+            "--max-poll",
+            "4",
             "--backend",
             args.backend,
         ],
-        stdout=sys.stdout,
+        # Echoed by _follow, which also lets the scenario wait on it
+        stdout=subprocess.PIPE,
         stderr=sys.stderr,  # Forward debug prints
         cwd=Path(__file__).parents[3],
+        # Descriptors Python opens are non-inheritable anyway, skip the scan
+        # closing all of them. Its own session keeps Ctrl+C for the scenario.
+        close_fds=False,
+        start_new_session=True,
+        text=True,
     )
-    # Give it a moment to start
-    time.sleep(3)
+    apps.append(prod_app)
+    prod_output = _follow(prod_app)
+    # Not waited for yet, it starts up while the dev session is prepared
 
     # 3. Start Development Session (Create dev branch)
     run_step(3, "Start Development Session")
     logger.info("Creating 'dev' branch from 'prod'")
 
-    if args.backend == "sql":
-        # SQL: dev_repo connects to same DB
-        dev_repo = create_repo(dev_repo_uri, branch="prod")
-        dev_repo.create_branch("dev", from_branch="prod")
-    else:
-        # Git: We act in the Dev Clone
-        # Clone happens automatically in init
-        dev_inst = create_repo(dev_repo_uri, branch="prod")
-        # Logic:
-        # dev_inst init -> clone from origin (master) -> checkout prod (pull from origin).
-        # We want to create 'dev' from 'prod'.
-        dev_inst.create_branch("dev", from_branch="prod")
-        # create_branch locally.
-        dev_inst.switch_branch("dev")
+    # SQL: dev_repo connects to same DB
+    # Git: dev_repo is the Dev Clone, its init makes a bare clone from origin
+    # and reads prod from there
+    dev_repo = create_repo(dev_repo_uri, branch="prod")
+    dev_repo.create_branch("dev", from_branch="prod")
+    dev_repo.switch_branch("dev")
 
     run_step(3, "Start Development App (on dev branch)")
     dev_app = subprocess.Popen(
         [
-            "uv",
-            "run",
-            "python",
+            sys.executable,
             "-m",
             "demo.app",
             "--repo-uri",
@@ -232,25 +295,30 @@ def main():
             "dev",
             "--name",
             "DevApp ",
-            "--poll-interval",
-            "5",
+            "--max-poll",
+            "4",
             "--backend",
             args.backend,
         ],
-        stdout=sys.stdout,
+        stdout=subprocess.PIPE,
         stderr=sys.stderr,
         cwd=Path(__file__).parents[3],
+        close_fds=False,
+        start_new_session=True,
+        text=True,
     )
-    time.sleep(3)
+    apps.append(dev_app)
+    dev_output = _follow(dev_app)
+    # Both apps start up side by side, each is ready once it shows its
+    # first config
+    _wait_for(prod_output, "[ProdApp] Feature X:")
+    _wait_for(dev_output, "[DevApp ] Feature X:")
 
     # 4. Modify Configuration in Dev
     run_step(4, "Modify Configuration (in Dev)")
     logger.info("Enabling Feature X and changing Theme to Dark in 'dev'")
 
-    # Use a fresh repo instance to be sure (or reuse)
-    dev_repo = create_repo(dev_repo_uri, branch="dev")
-    dev_repo.set("feature_x_enabled", b"true")
-    dev_repo.set("theme", b"dark")
+    dev_repo.set_many({"feature_x_enabled": b"true", "theme": b"dark"})
     if dev_repo.is_dirty():
         logger.info("Changes staged...")
     dev_repo.commit()
@@ -258,7 +326,7 @@ def main():
     logger.info("Changes committed to 'dev'")
 
     logger.info("Observing apps...")
-    time.sleep(10)
+    _wait_for(dev_output, "Theme: Dark")
 
     # 5. Verify Isolation
     run_step(5, "Verify Isolation")
@@ -270,46 +338,11 @@ def main():
     logger.info("Merging 'dev' into 'prod'")
 
     # Merge logic
+    # dev's changes win per key. The git merge commit is pushed right away,
+    # the SQL merge is staged and then committed.
+    prod_repo.merge("dev")
     if args.backend == "sql":
-        repo_prod = create_repo(prod_repo_uri, branch="prod")
-        repo_dev_read = create_repo(dev_repo_uri, branch="dev")
-        val_feat = repo_dev_read.get("feature_x_enabled")
-        val_theme = repo_dev_read.get("theme")
-        repo_prod.set("feature_x_enabled", val_feat)
-        repo_prod.set("theme", val_theme)
-        repo_prod.commit()
-    else:
-        # Git Merge:
-        # We need to merge origin/dev into prod.
-        # We can do this in our prod_repo clone.
-        # 1. Update our view of remote
-        # GitConfigRepo doesn't expose fetch explicitly, but reload() pulls current branch.
-        # But we need to merge a different branch.
-
-        # We need to run git merge. GitConfigRepo doesn't have `merge` method yet.
-        # We can use subprocess here just for the merge step as it's a "management" operation.
-        # OR we add merge support to ConfigRepo?
-        # Let's keep subprocess for the specific merge logic as it's complex logic (PR flow etc).
-
-        repo_prod = create_repo(prod_repo_uri, branch="prod")
-        path = repo_prod.work_path
-
-        # Fetch origin to get latest dev
-        subprocess.run(["git", "fetch", "origin"], cwd=path, check=True)
-        # Merge origin/dev
-        try:
-            subprocess.run(
-                ["git", "merge", "origin/dev", "-m", "Merge dev"], cwd=path, check=True
-            )
-        except subprocess.CalledProcessError:
-            print("[WARN] Merge failed? Maybe nothing to merge?")
-
-        # Push prod (using commit() or manual push?)
-        # Since we modified the repo via subprocess, usage of repo object might be stale?
-        # But if we just merged, we just need to push.
-        # repo.commit() only commits if dirty stage. Merge creates a commit usually.
-        # So we just need to push.
-        subprocess.run(["git", "push", "origin", "prod"], cwd=path, check=True)
+        prod_repo.commit()
 
     logger.info("Promoted changes to 'prod'")
 
@@ -319,18 +352,13 @@ def main():
 
     if args.backend == "git":
         # Prod App (running in subprocess) loops reload().
-        # reload() now does `git pull`.
+        # reload() fetches the branch from origin.
         # So it SHOULD pick up the changes we just pushed to origin!
         pass
 
-    time.sleep(10)
+    _wait_for(prod_output, "Theme: Dark")
 
     logger.info("Demo Complete. Terminating apps.")
-    prod_app.terminate()
-    dev_app.terminate()
-
-    prod_app.wait()
-    dev_app.wait()
 
 
 if __name__ == "__main__":